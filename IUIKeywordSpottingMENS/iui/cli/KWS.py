@@ -29,6 +29,8 @@ import logging
 import time
 from iui.utils.KeywordSpottingUtils import KeywordSpottingUtils 
 from iui.core.KWSOptions import KWSOptions 
+from iui.utils.KWSStats import KWSStats
+from iui.core.KWSCacheManager import prune_caches
 
 
 
@@ -110,16 +112,30 @@ if __name__ == '__main__':
     
     
     '''
-    start spotting
+    keep the ConfMat caches within the byte budget
     '''
-    logging.info("start spotting ...")
-    res = utils.spot(pageDoc, search_words, kwsOptions)
-
+    if kwsOptions.CONFMAT_CACHE_MAX_BYTES:
+        cache_root = kwsOptions.CONFMAT_CACHE_ROOT if kwsOptions.CONFMAT_CACHE_ROOT else file_path_to_process
+        prune_caches(cache_root, kwsOptions.CONFMAT_CACHE_MAX_BYTES, [utils.get_confmat_store_path(file_path_to_process, kwsOptions)])
+    
+    
     '''
-    creating result csv
+    start spotting
     '''
-    logging.info("spotting finished, writing results ...")    
-    utils.createFullCSV(pageDoc, res, kwsOptions)
+    stats = KWSStats()
+    if kwsOptions.STREAMING_MODE:
+        logging.info("start spotting, results are written line by line ...")
+        result_count = utils.spot_to_csv(pageDoc, search_words, kwsOptions, stats)
+        logging.info(f"spotting finished, {result_count} results written")
+    else:
+        logging.info("start spotting ...")
+        res = utils.spot(pageDoc, search_words, kwsOptions, stats)
+
+        '''
+        creating result csv
+        '''
+        logging.info("spotting finished, writing results ...")    
+        utils.createFullCSV(pageDoc, res, kwsOptions)
     
     # Record the end time
     end_time = time.time()
@@ -127,6 +143,8 @@ if __name__ == '__main__':
     # Calculate the processing time
     processing_time = end_time - start_time
     
+    logging.info(f"segments skipped by the confidence bound: {stats.skipped_word_count} of {stats.overall_word_count * len(search_words.split(','))} segment and search word pairs, {stats.skipped_line_count} lines skipped by their signature")
+    logging.info(f"searches degraded to the dp engine: {stats.degraded_by_cost_count} by their estimated cost, {stats.degraded_by_time_count} by the segment time budget")
     logging.info(f"Fin! Processing time: {processing_time} seconds")   
     print(f"Fin! Processing time: {processing_time} seconds")   
     
\ No newline at end of file
@@ -32,7 +32,9 @@ import logging
 import time
 import fnmatch
 from iui.utils.KeywordSpottingUtils import KeywordSpottingUtils 
-from iui.core.KWSOptions import KWSOptions 
+from iui.core.KWSOptions import KWSOptions, parse_byte_size
+from iui.core.KWSCacheManager import prune_caches
+from iui.utils.TopKRanking import TopKRanking
 
 
 """
@@ -65,6 +67,9 @@ def parse_arguments():
     parser.add_argument("--run_id", default="0001", help="Unique run ID")
     parser.add_argument("--no_reduction", default=False, action="store_true", help="Turn off reduction methods (default False)")
     parser.add_argument("--normalization_power", type=int, default=2, help="Normalization power (default is 2)") 
+    parser.add_argument("--streaming_mode", default=False, action="store_true", help="Spot and write the results line by line, keeps the memory constant for very large documents (default False)")
+    parser.add_argument("--top_k", type=int, default=0, help="Write only the best TOP_K hits per search word of all documents ranked to ranking_<run_id>.csv, segments which can not beat them are skipped (default 0 = all hits)")
+    parser.add_argument("--cache_max_bytes", type=parse_byte_size, default=0, help="Byte budget for all ConfMat caches below folder_path, e.g. 20G. Least recently used caches are evicted first (default 0 = unlimited)")
     parser.add_argument("folder_path", help="Path to the folder containing ConfMats documents")
     parser.add_argument("search_words", help="List of search words, best surround it with apostrophes")
     parser.add_argument("word_confidence", type=float, help="Word confidence as float from 0..1")
@@ -73,7 +78,7 @@ def parse_arguments():
 
 
 
-def process_document(document_path, run_id, search_words, word_confidence, no_reduction, normalization_power, kwsOptions = KWSOptions()):
+def process_document(document_path, run_id, search_words, word_confidence, no_reduction, normalization_power, kwsOptions = KWSOptions(), ranking = None):
     # Implement your document processing logic here
     try:
         utils = KeywordSpottingUtils()
@@ -94,9 +99,16 @@ def process_document(document_path, run_id, search_words, word_confidence, no_re
     
         pageDoc = utils.read_page(file_path_to_process, kwsOptions)
     
-        res = utils.spot(pageDoc, search_words, kwsOptions)
+        if kwsOptions.STREAMING_MODE:
+            #with a ranking the hits of all documents are ranked together and written at the end of the run
+            utils.spot_to_csv(pageDoc, search_words, kwsOptions, delete_old_csv = True, ranking=ranking)
+        elif ranking is not None:
+            #the hits of all documents are ranked together and written at the end of the run
+            utils.spot(pageDoc, search_words, kwsOptions, ranking=ranking)
+        else:
+            res = utils.spot(pageDoc, search_words, kwsOptions)
     
-        utils.createFullCSV(pageDoc, res, kwsOptions, True)
+            utils.createFullCSV(pageDoc, res, kwsOptions, True)
     
             # Record the end time
         end_time = time.time()
@@ -112,10 +124,21 @@ def process_document(document_path, run_id, search_words, word_confidence, no_re
         
         
 
-def process_documents_in_folder(folder_path, run_id, search_words, word_confidence, no_reduction, normalization_power, kwsOptions = KWSOptions()):
+def process_documents_in_folder(folder_path, run_id, search_words, word_confidence, no_reduction, normalization_power, kwsOptions = KWSOptions(), cache_max_bytes = 0):
+    utils = KeywordSpottingUtils()
+    ranking = TopKRanking(kwsOptions.TOP_K) if kwsOptions.TOP_K else None
     for root, _, files in os.walk(folder_path):
         for _ in fnmatch.filter(files, 'ConfMats.ark'):
-            process_document(root, run_id, search_words, word_confidence, no_reduction, normalization_power, kwsOptions)
+            process_document(root, run_id, search_words, word_confidence, no_reduction, normalization_power, kwsOptions, ranking)
+            if cache_max_bytes:
+                prune_caches(folder_path, cache_max_bytes, [utils.get_confmat_store_path(root, kwsOptions)])
+    
+    if ranking is not None:
+        output_file = os.path.join(folder_path, f"ranking_{run_id}.csv")
+        if os.path.exists(output_file):
+            os.remove(output_file)
+        utils.writeCSV(output_file, ranking.get_ranked_results())
+        logging.info(f"Ranked results saved to {output_file}")
 
 
 def merge_results(folder_path, run_id):
@@ -153,8 +176,12 @@ if __name__ == "__main__":
     
     args = parse_arguments()
     setup_logging(args.run_id, args.folder_path)
-    process_documents_in_folder(args.folder_path, args.run_id, args.search_words, args.word_confidence, args.no_reduction, args.normalization_power)
-    merge_results(args.folder_path, args.run_id)
+    kwsOptions = KWSOptions()
+    kwsOptions.STREAMING_MODE = args.streaming_mode
+    kwsOptions.TOP_K = args.top_k
+    process_documents_in_folder(args.folder_path, args.run_id, args.search_words, args.word_confidence, args.no_reduction, args.normalization_power, kwsOptions, cache_max_bytes=args.cache_max_bytes)
+    if not kwsOptions.TOP_K:
+        merge_results(args.folder_path, args.run_id)
     
     
     
@@ -0,0 +1,225 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This is the CLI Cache Manager Module to list, prune and pre-warm the
+    normalized ConfMat stores of a folder tree. Stores are evicted in
+    least recently used order until they fit into a given byte budget.
+    For a list of possible arguments please start the Programm with the
+    -h argument:
+    python -m iui.core.KWSCacheManager -h
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import os
+import time
+import fnmatch
+import logging
+import argparse
+from iui.core.KWSOptions import KWSOptions, parse_byte_size
+from iui.utils.ConfMatStore import DATA_SUFFIX, INDEX_SUFFIX
+from iui.utils.ArkIndex import ARK_INDEX_SUFFIX
+from iui.utils.KeywordSpottingUtils import KeywordSpottingUtils
+
+
+CACHE_PREFIX = "ConfMats_"
+LEGACY_DUMP_SUFFIX = ".dmp"
+TEMP_SUFFIX = ".tmp"
+TEMP_FILE_MAX_AGE = 24 * 60 * 60 #temporary store files older than this are left overs of crashed runs
+
+
+"""
+These functions are used to find, evict and create the ConfMat caches of all
+documents below a folder. It also contains a CLI Interface
+"""
+def find_caches(folder_path):
+    """
+    Collects all ConfMat caches below the given folder. Every cache is a dict with the
+    files belonging to it, the size in bytes and the last access time.
+    """
+    caches = []
+    for root, _, files in os.walk(folder_path):
+        for filename in fnmatch.filter(files, CACHE_PREFIX + "*" + INDEX_SUFFIX):
+            path_prefix = os.path.join(root, filename[:-len(INDEX_SUFFIX)])
+            cache_files = [path_prefix + INDEX_SUFFIX]
+            if os.path.exists(path_prefix + DATA_SUFFIX):
+                cache_files.append(path_prefix + DATA_SUFFIX)
+            caches.append(create_cache_entry(path_prefix, cache_files, os.path.getmtime(path_prefix + INDEX_SUFFIX)))
+
+        for filename in fnmatch.filter(files, CACHE_PREFIX + "*" + LEGACY_DUMP_SUFFIX) + fnmatch.filter(files, CACHE_PREFIX + "*" + ARK_INDEX_SUFFIX):
+            cache_path = os.path.join(root, filename)
+            caches.append(create_cache_entry(cache_path, [cache_path], os.path.getmtime(cache_path)))
+
+    return caches
+
+
+def create_cache_entry(name, cache_files, last_access):
+    """
+    Creates the dict describing one cache
+    """
+    return {"name": name, "files": cache_files, "size": sum(os.path.getsize(f) for f in cache_files), "last_access": last_access}
+
+
+def remove_cache(cache):
+    """
+    Deletes all files of the given cache, the index is removed first so a
+    concurrent reader never opens a store without data
+    """
+    for cache_file in sorted(cache["files"], key=lambda f: not f.endswith(INDEX_SUFFIX)):
+        try:
+            os.remove(cache_file)
+        except FileNotFoundError:
+            pass
+    logging.info(f"removed cache {cache['name']} ({cache['size']} bytes)")
+
+
+def remove_stale_temp_files(folder_path, max_age = TEMP_FILE_MAX_AGE):
+    """
+    Removes temporary store files of crashed runs
+    """
+    now = time.time()
+    for root, _, files in os.walk(folder_path):
+        for filename in fnmatch.filter(files, CACHE_PREFIX + "*" + TEMP_SUFFIX):
+            tmp_path = os.path.join(root, filename)
+            if now - os.path.getmtime(tmp_path) > max_age:
+                os.remove(tmp_path)
+                logging.info(f"removed stale temporary file {tmp_path}")
+
+
+def prune_caches(folder_path, max_bytes, keep = ()):
+    """
+    Evicts the least recently used caches below the given folder until all caches
+    together fit into max_bytes. Caches with a path prefix in keep are never evicted.
+    Returns the list of removed caches.
+    """
+    keep = {os.path.abspath(name) for name in keep}
+    remove_stale_temp_files(folder_path)
+    caches = sorted(find_caches(folder_path), key=lambda cache: cache["last_access"])
+    total_size = sum(cache["size"] for cache in caches)
+    removed = []
+    for cache in caches:
+        if total_size <= max_bytes:
+            break
+        if os.path.abspath(cache["name"]) in keep:
+            continue
+        remove_cache(cache)
+        total_size -= cache["size"]
+        removed.append(cache)
+
+    if total_size > max_bytes:
+        logging.warning(f"ConfMat caches in {folder_path} still use {total_size} bytes, budget is {max_bytes} bytes")
+    return removed
+
+
+def prewarm_caches(folder_path, kwsOptions:KWSOptions):
+    """
+    Creates the normalized ConfMat store for every document below the given folder,
+    documents which already have a store for the given options are only touched.
+    """
+    utils = KeywordSpottingUtils()
+    kwsOptions.USE_CONFMAT_DUMP = True
+    kwsOptions.CREATE_CONFMAT_DUMP = True
+    for root, _, files in os.walk(folder_path):
+        for _ in fnmatch.filter(files, 'ConfMats.ark'):
+            start_time = time.time()
+            utils.open_confmat_store(root, kwsOptions)
+            logging.info(f"cache ready for {root} after {time.time() - start_time} seconds")
+
+    if kwsOptions.CONFMAT_CACHE_MAX_BYTES:
+        prune_caches(folder_path, kwsOptions.CONFMAT_CACHE_MAX_BYTES)
+
+
+def print_caches(folder_path):
+    """
+    Prints all caches below the given folder, most recently used first
+    """
+    caches = sorted(find_caches(folder_path), key=lambda cache: cache["last_access"], reverse=True)
+    for cache in caches:
+        last_access = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(cache["last_access"]))
+        print(f"{last_access}\t{cache['size']:>14}\t{cache['name']}")
+    print(f"{len(caches)} caches, {sum(cache['size'] for cache in caches)} bytes")
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Manage the normalized ConfMat caches of a folder tree")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="List all caches, most recently used first")
+    list_parser.add_argument("folder_path", help="Path to the folder containing ConfMats documents")
+
+    prune_parser = subparsers.add_parser("prune", help="Evict least recently used caches until the budget is met")
+    prune_parser.add_argument("folder_path", help="Path to the folder containing ConfMats documents")
+    prune_parser.add_argument("max_bytes", type=parse_byte_size, help="Byte budget for all caches, accepts suffixes like 500M or 20G (0 removes all caches)")
+
+    prewarm_parser = subparsers.add_parser("prewarm", help="Create the caches for all documents")
+    prewarm_parser.add_argument("folder_path", help="Path to the folder containing ConfMats documents")
+    prewarm_parser.add_argument("-np", "--normalization_power", type=int, help="Set NORMALIZATION_POWER")
+    prewarm_parser.add_argument("-nc", "--normalization_cap", type=int, help="Set NORMALIZATION_CAP")
+    prewarm_parser.add_argument("-unc", "--use_normalization_cap", action="store_true", help="Enable USE_NORMALIZATION_CAP")
+    prewarm_parser.add_argument("-qz", "--quantization", choices=["uint8", "uint16"], help="Set QUANTIZATION")
+    prewarm_parser.add_argument("-stk", "--sparse_top_k", type=int, help="Set SPARSE_TOP_K")
+    prewarm_parser.add_argument("-fc", "--frame_compression", action="store_true", help="Enable FRAME_COMPRESSION")
+    prewarm_parser.add_argument("-sf", "--sparse_floor", type=float, help="Set SPARSE_FLOOR")
+    prewarm_parser.add_argument("-scm", "--scoring_mode", choices=["confidence", "ctc_posterior"], help="Set SCORING_MODE, ctc_posterior stores the raw ConfMats")
+    prewarm_parser.add_argument("-ec", "--equivalence_classes", help="Set EQUIVALENCE_CLASSES")
+    prewarm_parser.add_argument("-eic", "--equivalence_ignore_case", action="store_true", help="Enable EQUIVALENCE_IGNORE_CASE")
+    prewarm_parser.add_argument("-efd", "--equivalence_fold_diacritics", action="store_true", help="Enable EQUIVALENCE_FOLD_DIACRITICS")
+    prewarm_parser.add_argument("-ep", "--equivalence_pooling", choices=["max", "logsum"], help="Set EQUIVALENCE_POOLING")
+    prewarm_parser.add_argument("-cmb", "--confmat_cache_max_bytes", type=parse_byte_size, help="Prune the caches to this byte budget afterwards")
+
+    return parser.parse_args()
+
+
+def main():
+
+    '''
+    Print GNU GPL Messages
+    '''
+    print("The new Keyword Spotting Tool.  Copyright (C) 2023  Raphael Unterweger")
+    print("This program comes with ABSOLUTELY NO WARRANTY; for details type `show w'.")
+    print("This is free software, and you are welcome to redistribute it")
+    print("under certain conditions; type `show c' for details.\n")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s')
+    args = parse_arguments()
+
+    match args.command:
+        case "list":
+            print_caches(args.folder_path)
+        case "prune":
+            removed = prune_caches(args.folder_path, args.max_bytes)
+            print(f"Removed {len(removed)} caches with {sum(cache['size'] for cache in removed)} bytes")
+        case "prewarm":
+            kwsOptions = KWSOptions()
+            kwsOptions.NORMALIZATION_POWER = args.normalization_power if args.normalization_power else kwsOptions.NORMALIZATION_POWER
+            kwsOptions.NORMALIZATION_CAP = args.normalization_cap if args.normalization_cap else kwsOptions.NORMALIZATION_CAP
+            kwsOptions.USE_NORMALIZATION_CAP = args.use_normalization_cap or kwsOptions.USE_NORMALIZATION_CAP
+            kwsOptions.QUANTIZATION = args.quantization if args.quantization else kwsOptions.QUANTIZATION
+            kwsOptions.SPARSE_TOP_K = args.sparse_top_k if args.sparse_top_k else kwsOptions.SPARSE_TOP_K
+            kwsOptions.SPARSE_FLOOR = args.sparse_floor if args.sparse_floor is not None else kwsOptions.SPARSE_FLOOR
+            kwsOptions.FRAME_COMPRESSION = args.frame_compression or kwsOptions.FRAME_COMPRESSION
+            kwsOptions.SCORING_MODE = args.scoring_mode if args.scoring_mode else kwsOptions.SCORING_MODE
+            kwsOptions.EQUIVALENCE_CLASSES = args.equivalence_classes if args.equivalence_classes else kwsOptions.EQUIVALENCE_CLASSES
+            kwsOptions.EQUIVALENCE_IGNORE_CASE = args.equivalence_ignore_case or kwsOptions.EQUIVALENCE_IGNORE_CASE
+            kwsOptions.EQUIVALENCE_FOLD_DIACRITICS = args.equivalence_fold_diacritics or kwsOptions.EQUIVALENCE_FOLD_DIACRITICS
+            kwsOptions.EQUIVALENCE_POOLING = args.equivalence_pooling if args.equivalence_pooling else kwsOptions.EQUIVALENCE_POOLING
+            kwsOptions.CONFMAT_CACHE_MAX_BYTES = args.confmat_cache_max_bytes if args.confmat_cache_max_bytes is not None else kwsOptions.CONFMAT_CACHE_MAX_BYTES
+            prewarm_caches(args.folder_path, kwsOptions)
+
+if __name__ == "__main__":
+    main()
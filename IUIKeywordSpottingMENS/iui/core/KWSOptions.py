@@ -25,6 +25,17 @@
 import argparse
 
 
+def parse_byte_size(value):
+    """
+    Parses a byte size like 1024, 500M or 20G
+    """
+    units = {"K": 1024, "M": 1024**2, "G": 1024**3, "T": 1024**4}
+    value = str(value).strip().upper().removesuffix("B")
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+    return int(value)
+
+
 class KWSOptions(object):
     '''
     classdocs
@@ -43,10 +54,12 @@ class KWSOptions(object):
         
         self.CHARACTER_TRESHOLD = 0.98 #this determines quality and performance heavily
         self.WORD_CONFIDENCE = 0.95 #to filter resulting words by confidence, it will also determine the max char-Threshold
-        self.LIMIT_RESULTS = 10 #to limt the result list
+        self.LIMIT_RESULTS = 10 #to limt the result list, the kbest search engine reports up to this number of alternative alignments per segment and search word, each over another span of frames
+        self.TOP_K = 0 #only the TOP_K best hits per search word of the run are reported ranked, their lowest confidence raises the word confidence during the run, 0 reports all hits
         self.CLEAN_CTC_DOUBLE_CHARACTERS = False #when true, this will improve performace drastically, but will lead to siglty lower confidence value. The number of results should stay the same
         self.CLEAN_CTC_COLS = True # when true, ctc windows will be removed from the ConfMats in beforehand => Good Speed, Proper Confidences
         self.CLEAN_NONSEARCHWORD_CHARS = True
+        self.SPLIT_ON_FULL_ALPHABET = False #split the lines into words on the best path of all characters, not only of the search word characters kept by CLEAN_NONSEARCHWORD_CHARS
         self.NORMALIZATION_CAP = -65 #Confidences in the PyLaia ConfMat ranging from 0 to  -200 up to -500
         self.NORMALIZATION_POWER = 2 #ConfMat will be powered during normalization, the highe this number gets the more the higher confidences will be streched and the lower confidences will be compressed 
         self.USE_NORMALIZATION_CAP = False #apply normalization cap
@@ -54,6 +67,28 @@ class KWSOptions(object):
         self.REMOVE_HTR_CONTROL_SYMBOLS = True #sometimes there is a <$> in the HTR Output, not the Symbols List, these will be removed
         self.USE_CONFMAT_DUMP = True #Use the dumped ConfMat for quicker repeated searches
         self.CREATE_CONFMAT_DUMP = True #ConfMat will be dumped after normalization
+        self.CONFMAT_CACHE_MAX_BYTES = 0 #byte budget for all ConfMat caches below CONFMAT_CACHE_ROOT, least recently used caches are evicted first, 0 means unlimited
+        self.CONFMAT_CACHE_ROOT = None #folder whose ConfMat caches share the byte budget, defaults to the document folder
+        self.STREAMING_MODE = False #read, spot and write the results line by line, so memory does not grow with the document size
+        self.SCOPE_PAGE_IDS = None #comma separated list of page IDs, only lines of these pages are loaded and spotted
+        self.SCOPE_LINE_PATTERN = None #only lines whose line ID matches this fnmatch pattern are loaded and spotted, eg. r1l*
+        self.SCOPE_KEY_RANGE = None #first:last line key (inclusive, in ark order), an empty side means open, eg. 1001.line_5:1002.line_3
+        self.DECODE_WORKERS = 1 #number of processes decoding and normalizing the ConfMats.ark in parallel chunks
+        self.SPARSE_TOP_K = 0 #keep only the k best symbols per frame in a sparse ConfMat, 0 keeps all symbols
+        self.SPARSE_FLOOR = None #keep only normalized confidences of at least this value in a sparse ConfMat, should stay below the lowest character threshold
+        self.SEARCH_ENGINE = "enumeration" #"enumeration" scores all index combinations, "dp" finds the best combination by dynamic programming with the same result in linear time, "kbest" reports the best combinations of the LIMIT_RESULTS best frame spans per word as alternative alignments, "trie" finds the same hits as "dp" for all search words in one walk over a character trie
+        self.SCORING_MODE = "confidence" #"confidence" scores the mean normalized confidence of one frame per character, "ctc_posterior" the CTC forward posterior of the search word in the raw ConfMat segment
+        self.USE_WILDCARDS = False #search words may contain '?' for any character, '*' for up to WILDCARD_MAX_GAP characters and character classes like [iy]
+        self.WILDCARD_MAX_GAP = 3 #maximum number of characters matched by a '*'
+        self.FUZZY_MAX_EDITS = 0 #spot the search words with up to this number of inserted, deleted or substituted characters and report the spelling found, 0 disables the fuzzy search
+        self.FUZZY_EDIT_FACTOR = 0.98 #every edit of a fuzzy hit multiplies its confidence, the mean confidence of the characters read, by this factor
+        self.FRAME_COMPRESSION = False #collapse runs of frames with the same best symbol into one frame and drop blank frames at ingest, makes the lines about 3x shorter
+        self.QUANTIZATION = None #store and score the normalized ConfMats as "uint8" or "uint16" instead of float32, confidences differ at most 1/(2*255) resp. 1/(2*65535)
+        self.EQUIVALENCE_CLASSES = None #comma separated groups of equivalent characters like "ſs,uv,ij", their ConfMat columns are merged into the column of the first symbol
+        self.EQUIVALENCE_IGNORE_CASE = False #upper and lower case characters are equivalent
+        self.EQUIVALENCE_FOLD_DIACRITICS = False #characters with diacritics are equivalent to their base character
+        self.EQUIVALENCE_POOLING = "max" #"max" takes the best of the equivalent characters per frame, "logsum" adds their probabilities
+        self.LAZY_NORMALIZATION = False #keep the raw ConfMats and normalize only the cells above the character threshold mapped into the raw log probabilities, no ConfMat store is used
         
         #planned options for output format
         self.OUTPUT_CSV = True # create output CSV
@@ -68,8 +103,9 @@ class KWSOptions(object):
         self.OUTPUT_FORMAT_ADD_DOC_PATH = True # add local doc path, mainly usefull for batch processing
         
         #planned options for stability
-        self.INDICES_LIMIT = 4000000000 #if number of indices exceed this limit, following actions can be forced 
-        self.STOP_ON_LIMIT_EXCEED = False #will exit the programm when limit is reached
+        self.INDICES_LIMIT = 4000000000 #if the number of increasing index combinations exceeds this limit, the enumeration is replaced by the dp engine
+        self.STOP_ON_LIMIT_EXCEED = False #skips the search word instead, when the limit is reached
+        self.SEGMENT_TIME_BUDGET = 1.0 #seconds of the enumeration per segment, a search word whose estimated or measured enumeration exceeds it is searched by the dp engine, 0 disables the budget
         self.WARN_ON_LIMIT_EXCEED = True # displays a warning when limit is reached
         
         self.SHOWW = False
@@ -90,12 +126,14 @@ class KWSOptions(object):
         parser.add_argument("-lf", "--logging_format", help="Set a Log Level (default WARN, accepts: FATAL,INFO,DEBUG)")
         parser.add_argument("-r", "--run_id", help="Set the RUN_ID (Default: 0001)")
         parser.add_argument("-p", "--print_results_to_console", action="store_true", help="Print Results to std-out")
-        parser.add_argument("-q", "--query", help="Comma separated List of search words")
+        parser.add_argument("-q", "--query", help="Comma separated List of search words, search words with spaces like 'Johann Maier' are spotted as phrases across the word boundaries of a line")
         parser.add_argument("-wc", "--word_confidence", type=float, help="Set WORD_CONFIDENCE (Default: 0.95)")
-        parser.add_argument("-lr", "--limit_results", type=int, help="Set LIMIT_RESULTS will limit the number of result (default 4000000000)")
+        parser.add_argument("-tk", "--top_k", type=int, help="Set TOP_K (default 0 = all hits). Only the TOP_K best hits per search word are reported with their rank. Once a search word has TOP_K hits, segments which can not beat its lowest hit are skipped.")
+        parser.add_argument("-lr", "--limit_results", type=int, help="Set LIMIT_RESULTS will limit the number of alternative alignments per segment and search word of the kbest search engine, each covers another span of frames. They are alignments of the same occurrence, not separate hits (default 10)")
         parser.add_argument("-cd", "--clean_ctc_double_characters", action="store_true", help="Enable CLEAN_CTC_DOUBLE_CHARACTERS, when true, this will improve performace drastically, but will lead to siglty lower confidence values. The number of results should nearly stay the same.")
         parser.add_argument("-cc", "--clean_ctc_cols", action="store_true", help="Enable CLEAN_CTC_COLS, this Option will remove all CTC Windows from the matrix in beforehand. This will improve performance drastically and confidences stay nearly the same as without, because of the nature of the PyLaia ConfMat.")
         parser.add_argument("-cnsc", "--clean_nonsearchword_chars", action="store_true", help="Enable CLEAN_NONSEARCHWORD_CHARS, this Option will remove all Non-SearchWord-Character-Rows from the confidence matrix and by that will reduce the memory consumption, but eliminates the possibillity to carry over the correct confidence value for the best value written to the Page-XML ")
+        parser.add_argument("-sfa", "--split_on_full_alphabet", action="store_true", help="Enable SPLIT_ON_FULL_ALPHABET, with CLEAN_NONSEARCHWORD_CHARS the lines are split into words on the best path of all characters, as without it, instead of the best path of the search word characters. The best word then shows the characters of the full alphabet. Dense and sparse ConfMats are split alike.")
         parser.add_argument("-np", "--normalization_power", type=int, help="Set NORMALIZATION_POWER (default 8) This will stretch the ConfMats confidences, which helps to find a good word confidence")
         parser.add_argument("-nc", "--normalization_cap", type=int, help="Set NORMALIZATION_CAP. This will raise very low confidences in the matrix and can be used for two reasons: a) it will stretch the confidences and makes finding a good threshold easier and b) gives us the possibility to raise very low characters back into scope")
         parser.add_argument("-unc", "--use_normalization_cap", action="store_true", help="Enable USE_NORMALIZATION_CAP")
@@ -110,11 +148,34 @@ class KWSOptions(object):
         parser.add_argument("-oafls", "--output_format_add_line_snippets", action="store_true", help="Enable OUTPUT_FORMAT_ADD_LINE_SNIPPETS, will add a link to the line snippet")
         parser.add_argument("-oafwc", "--output_format_add_word_count", action="store_true", help="Enable OUTPUT_FORMAT_ADD_WORD_COUNT, will add word count stats")
         parser.add_argument("-oafdp", "--output_format_add_doc_path", action="store_true", help="Enable OUTPUT_FORMAT_ADD_DOC_PATH, will add the page document path to the output CSV")
-        parser.add_argument("-il", "--indices_limit", type=int, help="Set INDICES_LIMIT. The number of possible combinations will be calculated in beforhand and can be used to skip processing of problematic lines.")
-        parser.add_argument("-sol", "--stop_on_limit_exceed", action="store_true", help="Enable STOP_ON_LIMIT_EXCEED")
+        parser.add_argument("-il", "--indices_limit", type=int, help="Set INDICES_LIMIT. The number of increasing index combinations will be calculated in beforhand, search words above the limit are searched by the dp engine instead of the enumeration.")
+        parser.add_argument("-sol", "--stop_on_limit_exceed", action="store_true", help="Enable STOP_ON_LIMIT_EXCEED, search words above the INDICES_LIMIT are skipped")
+        parser.add_argument("-stb", "--segment_time_budget", type=float, help="Set SEGMENT_TIME_BUDGET in seconds (default 1.0, 0 disables it). The enumeration time is estimated from the number of increasing index combinations and calibrated during the run, a search word which would exceed the budget of its segment, or exceeds it, is searched by the dp engine with the same result.")
         parser.add_argument("-wol", "--warn_on_limit_exceed", action="store_true", help="Enable WARN_ON_LIMIT_EXCEED")
         parser.add_argument("-ucd", "--use_confmat_dump", action="store_true", help="This will use the dumped confmat and with that speed up repeated searches")
         parser.add_argument("-ccd", "--create_confmat_dump", action="store_true", help="This will dump the normalized confmat")
+        parser.add_argument("-cmb", "--confmat_cache_max_bytes", type=parse_byte_size, help="Set CONFMAT_CACHE_MAX_BYTES, the byte budget for all ConfMat caches below CONFMAT_CACHE_ROOT (accepts suffixes like 500M or 20G). Least recently used caches are evicted first.")
+        parser.add_argument("-cr", "--confmat_cache_root", help="Set CONFMAT_CACHE_ROOT, the folder whose ConfMat caches share the byte budget (default: the document folder)")
+        parser.add_argument("-sp", "--scope_pages", help="Set SCOPE_PAGE_IDS, a comma separated list of page IDs. Only these pages are loaded from the ConfMats.ark via its offset index.")
+        parser.add_argument("-slp", "--scope_line_pattern", help="Set SCOPE_LINE_PATTERN, only lines whose line ID matches this pattern (eg. r1l*) are loaded and spotted")
+        parser.add_argument("-skr", "--scope_key_range", help="Set SCOPE_KEY_RANGE as first:last line key, both inclusive and in ark order, an empty side means open")
+        parser.add_argument("-dw", "--decode_workers", type=int, help="Set DECODE_WORKERS, the number of processes decoding and normalizing the ConfMats.ark in parallel chunks (default 1)")
+        parser.add_argument("-stk", "--sparse_top_k", type=int, help="Set SPARSE_TOP_K, only the k best symbols per frame are kept in a sparse ConfMat. This reduces memory and cache size for wide alphabets, cells not kept count as zero.")
+        parser.add_argument("-sf", "--sparse_floor", type=float, help="Set SPARSE_FLOOR, only normalized confidences of at least this value are kept in a sparse ConfMat. Results stay exact as long as the floor is below the lowest character threshold. With CLEAN_NONSEARCHWORD_CHARS a frame without kept cells of the search word characters reads as <ctc> in the best path, use SPLIT_ON_FULL_ALPHABET to split sparse and dense ConfMats alike.")
+        parser.add_argument("-se", "--search_engine", choices=["enumeration", "dp", "kbest", "trie"], help="Set SEARCH_ENGINE (default enumeration). The dp engine finds the same best hit per word by dynamic programming, its runtime grows linear with word and line length, so INDICES_LIMIT is not needed. The kbest engine reports the best alignments of the LIMIT_RESULTS best frame spans per word, these are alternative alignments, not separate hits. The trie engine finds the hits of the dp engine, but search words with a common prefix share its alignment, which pays off for long search word lists.")
+        parser.add_argument("-scm", "--scoring_mode", choices=["confidence", "ctc_posterior"], help="Set SCORING_MODE (default confidence). ctc_posterior scores every segment by the CTC posterior of the search word computed from the raw ConfMat, WORD_CONFIDENCE is then a probability. Quantization, sparse ConfMats and frame compression are not used in this mode.")
+        parser.add_argument("-uw", "--use_wildcards", action="store_true", help="Enable USE_WILDCARDS, search words like 'Joh?n', 'Mül*er' or 'M[ae][iy]er' are spotted as patterns. The characters of a pattern must follow each other directly, a '*' allows up to WILDCARD_MAX_GAP other characters, at the start or end of a pattern like in 'Mai*' these characters are added to the hit.")
+        parser.add_argument("-wmg", "--wildcard_max_gap", type=int, help="Set WILDCARD_MAX_GAP (default 3)")
+        parser.add_argument("-fme", "--fuzzy_max_edits", type=int, help="Set FUZZY_MAX_EDITS (default 0). Every search word is spotted with up to this number of inserted, deleted or substituted characters in one pass, the hit contains the spelling found. Its confidence is the mean confidence of the characters read times FUZZY_EDIT_FACTOR per edit.")
+        parser.add_argument("-fef", "--fuzzy_edit_factor", type=float, help="Set FUZZY_EDIT_FACTOR (default 0.98), every insertion, deletion or substitution multiplies the confidence of a fuzzy hit by this factor")
+        parser.add_argument("-fc", "--frame_compression", action="store_true", help="Enable FRAME_COMPRESSION, runs of frames with the same best symbol are max-pooled into one frame and blank frames are dropped once at ingest. The compressed ConfMats are cached and make all searches faster, confidences will differ slightly.")
+        parser.add_argument("-qz", "--quantization", choices=["uint8", "uint16"], help="Set QUANTIZATION, the normalized ConfMats are stored and scored as 8 or 16 bit integers. This reduces memory and cache size 4-8x, the confidences differ at most 1/(2*255) for uint8 and 1/(2*65535) for uint16.")
+        parser.add_argument("-ec", "--equivalence_classes", help="Set EQUIVALENCE_CLASSES, comma separated groups of equivalent characters like 'ſs,uv,ij'. The ConfMat columns of a group are merged once per line, so one search covers all spelling variants.")
+        parser.add_argument("-eic", "--equivalence_ignore_case", action="store_true", help="Enable EQUIVALENCE_IGNORE_CASE, upper and lower case characters are merged")
+        parser.add_argument("-efd", "--equivalence_fold_diacritics", action="store_true", help="Enable EQUIVALENCE_FOLD_DIACRITICS, characters with diacritics are merged with their base character")
+        parser.add_argument("-ep", "--equivalence_pooling", choices=["max", "logsum"], help="Set EQUIVALENCE_POOLING (default max), logsum adds the probabilities of the merged characters")
+        parser.add_argument("-ln", "--lazy_normalization", action="store_true", help="Enable LAZY_NORMALIZATION, the raw ConfMats.ark is spotted without normalizing it at ingest. The character threshold is mapped into the raw log probabilities and only the cells passing it are normalized. Use it for one-off searches, no ConfMat store is read or created and QUANTIZATION and sparse ConfMats are not used.")
+        parser.add_argument("-sm", "--streaming_mode", action="store_true", help="Enable STREAMING_MODE, the ConfMats are read, spotted and the results written line by line instead of loading the whole document first. Use it for very large documents.")
 
         
         args = parser.parse_args()
@@ -134,9 +195,11 @@ class KWSOptions(object):
         self.search_words = args.query if args.query else self.search_words
         self.WORD_CONFIDENCE = args.word_confidence if args.word_confidence else self.WORD_CONFIDENCE
         self.LIMIT_RESULTS = args.limit_results if args.limit_results else self.LIMIT_RESULTS
+        self.TOP_K = args.top_k if args.top_k is not None else self.TOP_K
         self.CLEAN_CTC_DOUBLE_CHARACTERS = args.clean_ctc_double_characters or self.CLEAN_CTC_DOUBLE_CHARACTERS
         self.CLEAN_CTC_COLS = args.clean_ctc_cols or self.CLEAN_CTC_COLS
         self.CLEAN_NONSEARCHWORD_CHARS = args.clean_nonsearchword_chars or self.CLEAN_NONSEARCHWORD_CHARS
+        self.SPLIT_ON_FULL_ALPHABET = args.split_on_full_alphabet or self.SPLIT_ON_FULL_ALPHABET
         self.NORMALIZATION_CAP = args.normalization_cap if args.normalization_cap else self.NORMALIZATION_CAP
         self.USE_NORMALIZATION_CAP = args.use_normalization_cap or self.USE_NORMALIZATION_CAP
         self.ADJUST_CONFIDENCE_BY_WORD_LENGTH = args.adjust_confidence_by_word_length or self.ADJUST_CONFIDENCE_BY_WORD_LENGTH
@@ -151,9 +214,32 @@ class KWSOptions(object):
         self.OUTPUT_FORMAT_ADD_DOC_PATH = args.output_format_add_doc_path or self.OUTPUT_FORMAT_ADD_DOC_PATH
         self.INDICES_LIMIT = args.indices_limit if args.indices_limit else self.INDICES_LIMIT
         self.STOP_ON_LIMIT_EXCEED = args.stop_on_limit_exceed or self.STOP_ON_LIMIT_EXCEED
+        self.SEGMENT_TIME_BUDGET = args.segment_time_budget if args.segment_time_budget is not None else self.SEGMENT_TIME_BUDGET
         self.WARN_ON_LIMIT_EXCEED = args.warn_on_limit_exceed or self.WARN_ON_LIMIT_EXCEED
         self.USE_CONFMAT_DUMP = args.use_confmat_dump or self.USE_CONFMAT_DUMP
         self.CREATE_CONFMAT_DUMP = args.create_confmat_dump or self.CREATE_CONFMAT_DUMP
+        self.CONFMAT_CACHE_MAX_BYTES = args.confmat_cache_max_bytes if args.confmat_cache_max_bytes else self.CONFMAT_CACHE_MAX_BYTES
+        self.CONFMAT_CACHE_ROOT = args.confmat_cache_root if args.confmat_cache_root else self.CONFMAT_CACHE_ROOT
+        self.STREAMING_MODE = args.streaming_mode or self.STREAMING_MODE
+        self.SCOPE_PAGE_IDS = args.scope_pages if args.scope_pages else self.SCOPE_PAGE_IDS
+        self.SCOPE_LINE_PATTERN = args.scope_line_pattern if args.scope_line_pattern else self.SCOPE_LINE_PATTERN
+        self.SCOPE_KEY_RANGE = args.scope_key_range if args.scope_key_range else self.SCOPE_KEY_RANGE
+        self.DECODE_WORKERS = args.decode_workers if args.decode_workers else self.DECODE_WORKERS
+        self.SPARSE_TOP_K = args.sparse_top_k if args.sparse_top_k else self.SPARSE_TOP_K
+        self.SPARSE_FLOOR = args.sparse_floor if args.sparse_floor is not None else self.SPARSE_FLOOR
+        self.SEARCH_ENGINE = args.search_engine if args.search_engine else self.SEARCH_ENGINE
+        self.SCORING_MODE = args.scoring_mode if args.scoring_mode else self.SCORING_MODE
+        self.USE_WILDCARDS = args.use_wildcards or self.USE_WILDCARDS
+        self.WILDCARD_MAX_GAP = args.wildcard_max_gap if args.wildcard_max_gap is not None else self.WILDCARD_MAX_GAP
+        self.FUZZY_MAX_EDITS = args.fuzzy_max_edits if args.fuzzy_max_edits is not None else self.FUZZY_MAX_EDITS
+        self.FUZZY_EDIT_FACTOR = args.fuzzy_edit_factor if args.fuzzy_edit_factor is not None else self.FUZZY_EDIT_FACTOR
+        self.FRAME_COMPRESSION = args.frame_compression or self.FRAME_COMPRESSION
+        self.QUANTIZATION = args.quantization if args.quantization else self.QUANTIZATION
+        self.EQUIVALENCE_CLASSES = args.equivalence_classes if args.equivalence_classes else self.EQUIVALENCE_CLASSES
+        self.EQUIVALENCE_IGNORE_CASE = args.equivalence_ignore_case or self.EQUIVALENCE_IGNORE_CASE
+        self.EQUIVALENCE_FOLD_DIACRITICS = args.equivalence_fold_diacritics or self.EQUIVALENCE_FOLD_DIACRITICS
+        self.EQUIVALENCE_POOLING = args.equivalence_pooling if args.equivalence_pooling else self.EQUIVALENCE_POOLING
+        self.LAZY_NORMALIZATION = args.lazy_normalization or self.LAZY_NORMALIZATION
         
         if len(args.directory_path) == 2:
             if args.directory_path[0] == 'show' and args.directory_path[1] == 'c':
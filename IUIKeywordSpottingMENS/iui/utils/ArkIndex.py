@@ -0,0 +1,227 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module contains an offset index for the ConfMats.ark. Like a Kaldi
+    .scp it maps every line key to the byte offset of its matrix, so single
+    lines can be loaded without decoding the whole ark and big arks can be
+    decoded in parallel chunks.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import os
+import struct
+import fnmatch
+import logging
+import tempfile
+import multiprocessing
+from collections import deque
+from collections.abc import Mapping
+from kaldiio import load_mat
+from kaldiio.matio import read_token, read_kaldi
+
+
+ARK_INDEX_SUFFIX = ".scp"
+DEFAULT_CHUNK_SIZE = 64 #lines decoded by one worker task
+CHUNKS_IN_FLIGHT_PER_WORKER = 2 #chunks submitted ahead per worker, so a slow consumer keeps the memory bounded
+
+
+"""
+Function to restrict line keys to a scope, it works on the ark index as well as
+on the keys of a ConfMatStore
+"""
+def select_keys(keys, page_ids = None, line_pattern = None, key_range = None):
+    """
+    Returns the keys in their original order, which belong to one of the given page IDs,
+    whose line ID matches the fnmatch line_pattern and which lie within the key range.
+    The key range is a tuple (first, last), both inclusive and in ark order, None means open.
+    """
+    first_key, last_key = key_range if key_range else (None, None)
+    in_range = first_key is None
+    selected = []
+    for key in keys:
+        if not in_range and key == first_key:
+            in_range = True
+        if in_range:
+            page_id, _, line_id = key.partition('.')
+            if (page_ids is None or page_id in page_ids) and (line_pattern is None or fnmatch.fnmatchcase(line_id, line_pattern)):
+                selected.append(key)
+        if key == last_key:
+            break
+    return selected
+
+
+def _read_chunk(chunk):
+    """
+    Worker function, decodes the matrices at the given offsets and applies the transform
+    """
+    ark_path, key_offsets, transform, transform_args = chunk
+    fd_dict = {}
+    try:
+        res = []
+        for key, offset in key_offsets:
+            matrix = load_mat(f"{ark_path}:{offset}", fd_dict=fd_dict)
+            if transform is not None:
+                matrix = transform(matrix, *transform_args)
+            res.append((key, matrix))
+        return res
+    finally:
+        for fd in fd_dict.values():
+            fd.close()
+
+
+
+class ArkIndex(Mapping):
+    '''
+    Mapping of the line keys of a ConfMats.ark to the byte offsets of their matrices,
+    in ark order. The index is written as text file with lines "key ark_name:offset",
+    the ark name is relative to the index, so the document folder can be moved.
+    '''
+
+
+    def __init__(self, ark_path, offsets):
+        '''
+        Constructor
+        '''
+        self.ark_path = ark_path
+        self.offsets = offsets
+
+
+    @staticmethod
+    def build(ark_path):
+        """
+        Scans the ark once and collects the offsets. Float and double matrices are skipped
+        by their header, all other Kaldi objects are decoded with kaldiio to find their end.
+        """
+        offsets = {}
+        with open(ark_path, 'rb') as ark_file:
+            while True:
+                key = read_token(ark_file)
+                if key is None:
+                    break
+                offset = ark_file.tell()
+                offsets[key] = offset
+                header = ark_file.read(15)
+                if header[:5] in (b"\0BFM ", b"\0BDM ") and header[5:6] == b"\4" and header[10:11] == b"\4":
+                    rows, = struct.unpack('<i', header[6:10])
+                    cols, = struct.unpack('<i', header[11:15])
+                    item_size = 4 if header[2:3] == b"F" else 8
+                    ark_file.seek(offset + 15 + rows * cols * item_size)
+                else:
+                    ark_file.seek(offset)
+                    read_kaldi(ark_file)
+        logging.debug(f"indexed {len(offsets)} lines of {ark_path}")
+        return ArkIndex(ark_path, offsets)
+
+
+    @staticmethod
+    def load(index_path, ark_path):
+        """
+        Reads the index written by save, returns None if there is no valid index
+        """
+        if not os.path.exists(index_path):
+            return None
+        offsets = {}
+        try:
+            with open(index_path, 'r', encoding='utf-8') as index_file:
+                for line in index_file:
+                    key, location = line.rstrip('\n').split(' ', 1)
+                    offsets[key] = int(location.rsplit(':', 1)[1])
+        except (OSError, ValueError, IndexError) as e:
+            logging.warning(f"ignoring ark index {index_path}: {e}")
+            return None
+        return ArkIndex(ark_path, offsets)
+
+
+    def save(self, index_path):
+        """
+        Writes the index to a temporary file and moves it to the given path
+        """
+        directory, name = os.path.split(index_path)
+        fd, tmp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory or ".")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as index_file:
+                ark_name = os.path.basename(self.ark_path)
+                for key, offset in self.offsets.items():
+                    index_file.write(f"{key} {ark_name}:{offset}\n")
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, index_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+    def select(self, page_ids = None, line_pattern = None, key_range = None):
+        """
+        Returns the keys of the given scope, see select_keys
+        """
+        return select_keys(self.offsets, page_ids, line_pattern, key_range)
+
+
+    def read(self, keys = None):
+        """
+        Generator, which loads the matrices of the given keys (default all) one after another
+        """
+        keys = self.offsets if keys is None else keys
+        fd_dict = {}
+        try:
+            for key in keys:
+                yield key, load_mat(f"{self.ark_path}:{self.offsets[key]}", fd_dict=fd_dict)
+        finally:
+            for fd in fd_dict.values():
+                fd.close()
+
+
+    def read_parallel(self, keys = None, workers = 2, transform = None, transform_args = (), chunk_size = DEFAULT_CHUNK_SIZE):
+        """
+        Generator, which lets a pool of worker processes decode the matrices of the given keys
+        in chunks. The transform function, eg. the normalization, runs in the workers as well.
+        The matrices are yielded in the order of the keys. Only workers * CHUNKS_IN_FLIGHT_PER_WORKER
+        chunks are decoded ahead of the consumer, so with the streaming mode not the whole ark is held
+        in memory, when the spotting is slower than the decoding.
+        """
+        keys = list(self.offsets if keys is None else keys)
+        chunks = ((self.ark_path, [(key, self.offsets[key]) for key in keys[i:i + chunk_size]], transform, transform_args) for i in range(0, len(keys), chunk_size))
+        with multiprocessing.Pool(workers) as pool:
+            pending = deque()
+            for chunk in chunks:
+                pending.append(pool.apply_async(_read_chunk, (chunk,)))
+                if len(pending) >= workers * CHUNKS_IN_FLIGHT_PER_WORKER:
+                    yield from pending.popleft().get()
+            while pending:
+                yield from pending.popleft().get()
+
+
+    def __getitem__(self, key):
+        return self.offsets[key]
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __contains__(self, key):
+        return key in self.offsets
@@ -0,0 +1,403 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module contains a binary store for the normalized ConfMats. All
+    matrices of a document are written into one contiguous array file plus
+    an index file, so they can be opened with np.memmap for repeated searches.
+    Dense matrices as well as SparseConfMats can be stored, optionally together
+    with the frame map of compressed ConfMats, the best path and the signature
+    of every line.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import os
+import json
+import logging
+import tempfile
+import numpy as np
+from collections.abc import Mapping
+from iui.utils.SparseConfMat import SparseConfMat, INDICES_DTYPE, INDPTR_DTYPE
+from iui.utils.KeywordSpottingMatrixUtils import select_best_path
+
+
+STORE_VERSION = 3
+DATA_SUFFIX = ".dat"
+INDEX_SUFFIX = ".idx"
+ALIGNMENT = 8 #every array in the data file starts at a multiple of this byte offset
+FRAME_MAP_DTYPE = np.dtype(np.int32)
+BEST_PATH_DTYPE = np.dtype(np.int32)
+
+
+class ConfMatStore(Mapping):
+    '''
+    Read-only access to a ConfMat store. The matrices are returned as views into
+    a np.memmap, so only the pages actually used are read and concurrent KWS
+    processes on one host share them through the OS page cache.
+    '''
+
+
+    def __init__(self, path_prefix):
+        '''
+        Constructor, opens the store written by ConfMatStoreWriter for the given path prefix.
+        A ValueError is raised, if the store is not complete or was written by another version.
+        '''
+        self.path_prefix = path_prefix
+        with open(path_prefix + INDEX_SUFFIX, 'r', encoding='utf-8') as index_file:
+            index = json.load(index_file)
+        if index.get("version") != STORE_VERSION:
+            raise ValueError(f"ConfMat store {path_prefix} has version {index.get('version')}, expected {STORE_VERSION}")
+        if os.path.getsize(path_prefix + DATA_SUFFIX) != index["data_bytes"]:
+            raise ValueError(f"ConfMat store {path_prefix} is incomplete")
+        self.dtype = np.dtype(index["dtype"])
+        self.sparse = index.get("sparse", False)
+        self.entries = index["entries"]
+        self.frame_maps = index.get("frame_maps", {})
+        self.best_paths = index.get("best_paths", {})
+        self.signatures = index.get("signatures", {})
+        self.data = None
+        if index["data_bytes"] > 0:
+            self.data = np.memmap(path_prefix + DATA_SUFFIX, dtype=np.uint8, mode='r')
+
+
+    @staticmethod
+    def load(path_prefix):
+        """
+        Opens the store for the given path prefix, returns None if there is no complete store
+        """
+        if not (os.path.exists(path_prefix + INDEX_SUFFIX) and os.path.exists(path_prefix + DATA_SUFFIX)):
+            return None
+        try:
+            return ConfMatStore(path_prefix)
+        except (OSError, ValueError, KeyError) as e:
+            logging.warning(f"ignoring ConfMat store {path_prefix}: {e}")
+            return None
+
+
+    def touch(self):
+        """
+        Marks the store as recently used, the index modification time is the last access time
+        used by the cache eviction
+        """
+        try:
+            os.utime(self.path_prefix + INDEX_SUFFIX)
+        except OSError as e:
+            logging.debug(f"could not update access time of {self.path_prefix}: {e}")
+
+
+    def _get_array(self, offset, dtype, count):
+        """
+        Returns count values of the given dtype at the byte offset as view into the memmap
+        """
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return self.data[offset:offset + count * dtype.itemsize].view(dtype)
+
+    def __getitem__(self, key):
+        if not self.sparse:
+            offset, rows, cols = self.entries[key]
+            return self._get_array(offset, self.dtype, rows * cols).reshape(rows, cols)
+        offset, rows, cols, nnz = self.entries[key]
+        data = self._get_array(offset, self.dtype, nnz)
+        offset += aligned_size(nnz * self.dtype.itemsize)
+        indices = self._get_array(offset, INDICES_DTYPE, nnz)
+        offset += aligned_size(nnz * INDICES_DTYPE.itemsize)
+        indptr = self._get_array(offset, INDPTR_DTYPE, rows + 1)
+        return SparseConfMat(data, indices, indptr, (rows, cols))
+
+    def get_frame_map(self, key):
+        """
+        Returns the first and last original frame of every frame of a compressed ConfMat,
+        or None if the store holds no frame map for this line
+        """
+        if key not in self.frame_maps:
+            return None
+        offset, rows = self.frame_maps[key]
+        return self._get_array(offset, FRAME_MAP_DTYPE, rows * 2).reshape(rows, 2)
+
+    def get_best_path(self, key):
+        """
+        Returns the best symbol of every frame of a ConfMat, or None if the store holds
+        no best path for this line
+        """
+        if key not in self.best_paths:
+            return None
+        offset, rows = self.best_paths[key]
+        return self._get_array(offset, BEST_PATH_DTYPE, rows)
+
+    def get_signature(self, key):
+        """
+        Returns the best value of every symbol column of a ConfMat, or None if the store holds
+        no signature for this line
+        """
+        if key not in self.signatures:
+            return None
+        offset, cols = self.signatures[key]
+        return self._get_array(offset, self.dtype, cols)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+
+
+def aligned_size(byte_count):
+    """
+    Returns the byte count rounded up to the next multiple of ALIGNMENT
+    """
+    return -(-byte_count // ALIGNMENT) * ALIGNMENT
+
+
+
+class ConfMatColumnView(Mapping):
+    '''
+    Mapping of line keys to ConfMats, which only contains the given columns of the
+    underlying full-alphabet matrices. This is used to cut the search word characters
+    out of a ConfMatStore for one query. If keys are given, only these lines are visible.
+    With full_best_paths the persisted full-alphabet best paths are mapped into the columns.
+    '''
+
+
+    def __init__(self, conf_mats, col_indices=None, keys=None, full_best_paths=False):
+        '''
+        Constructor
+        '''
+        self.conf_mats = conf_mats
+        self.col_indices = col_indices
+        self.keys = keys
+        self.full_best_paths = full_best_paths
+
+    def __getitem__(self, key):
+        matrix = self.conf_mats[key]
+        if self.col_indices is None:
+            return matrix
+        return matrix[:, self.col_indices]
+
+    def get_best_path(self, key):
+        """
+        Returns the persisted best path of a line and None as its values. The best path of a column
+        selection is not persisted, so None is returned then, or with full_best_paths the full-alphabet
+        best path mapped into the columns, see select_best_path, and the values of its cells.
+        """
+        best_path = self.conf_mats.get_best_path(key) if hasattr(self.conf_mats, "get_best_path") else None
+        if best_path is None:
+            return None
+        if self.col_indices is None:
+            return best_path, None
+        if not self.full_best_paths:
+            return None
+        best_path = np.asarray(best_path, dtype=np.intp)
+        return select_best_path(best_path, self.col_indices), np.asarray(self.conf_mats[key][np.arange(len(best_path)), best_path])
+
+    def get_signature(self, key):
+        """
+        Returns the persisted signature of a line reduced to the given columns, or None
+        """
+        signature = self.conf_mats.get_signature(key) if hasattr(self.conf_mats, "get_signature") else None
+        if signature is None or self.col_indices is None:
+            return signature
+        return signature[self.col_indices]
+
+    def __iter__(self):
+        return iter(self.conf_mats if self.keys is None else self.keys)
+
+    def __len__(self):
+        return len(self.conf_mats if self.keys is None else self.keys)
+
+    def __contains__(self, key):
+        return key in self.conf_mats and (self.keys is None or key in self.keys)
+
+
+
+class ConfMatDict(dict):
+    '''
+    In-memory mapping of line keys to ConfMats, which holds the full-alphabet best path
+    of every line taken before the column selection as well, see select_columns
+    '''
+
+
+    def __init__(self, items):
+        '''
+        Constructor, the items are (line key, ConfMat, best path) triples, the best path is None
+        or a pair of the best symbols and their values
+        '''
+        super().__init__()
+        self.best_paths = {}
+        for key, conf_mat, best_path in items:
+            self[key] = conf_mat
+            self.best_paths[key] = best_path
+
+    def get_best_path(self, key):
+        """
+        Returns the best path of a line, or None
+        """
+        return self.best_paths.get(key)
+
+
+
+class ConfMatStream(object):
+    '''
+    Iterable of (line key, ConfMat) pairs, which are produced by a generator function
+    on demand and not kept in memory. Every call of items() starts a new pass, so the
+    stream can be consumed like the items of a Mapping. The generator yields (line key,
+    ConfMat, best path) triples, the best path of the current line is kept for get_best_path.
+    '''
+
+
+    def __init__(self, generator_function, *args):
+        '''
+        Constructor, the generator function is called with the given arguments for every pass
+        '''
+        self.generator_function = generator_function
+        self.args = args
+        self.best_path = (None, None)
+
+    def items(self):
+        for key, conf_mat, best_path in self.generator_function(*self.args):
+            self.best_path = (key, best_path)
+            yield key, conf_mat
+
+    def get_best_path(self, key):
+        """
+        Returns the best path of the current line, or None
+        """
+        return self.best_path[1] if self.best_path[0] == key else None
+
+    def __iter__(self):
+        return (key for key, _ in self.items())
+
+
+
+class ConfMatStoreWriter(object):
+    '''
+    Writes matrices one after another into a ConfMat store. Data and index are written
+    to temporary files first and atomically renamed when the writer is closed, so parallel
+    workers or crashed runs never leave a truncated store behind. A sparse store holds
+    SparseConfMats only, a dense store numpy matrices only.
+    '''
+
+
+    def __init__(self, path_prefix, dtype=np.float32, sparse=False):
+        '''
+        Constructor
+        '''
+        self.path_prefix = path_prefix
+        self.dtype = np.dtype(dtype)
+        self.sparse = sparse
+        self.entries = {}
+        self.frame_maps = {}
+        self.best_paths = {}
+        self.signatures = {}
+        self.offset = 0
+        self.data_file, self.data_tmp_path = self._create_temp_file(DATA_SUFFIX)
+
+
+    def _create_temp_file(self, suffix):
+        """
+        Creates a temporary file next to the final store file
+        """
+        directory, name = os.path.split(self.path_prefix + suffix)
+        fd, tmp_path = tempfile.mkstemp(prefix=name + ".", suffix=".tmp", dir=directory or ".")
+        #mkstemp creates private files, but the store should be readable like the ark itself
+        os.chmod(tmp_path, 0o644)
+        return os.fdopen(fd, 'wb'), tmp_path
+
+
+    def _write_array(self, array, dtype):
+        """
+        Writes the array padded to the alignment
+        """
+        data = np.ascontiguousarray(array, dtype=dtype).tobytes()
+        self.data_file.write(data)
+        self.data_file.write(bytes(aligned_size(len(data)) - len(data)))
+        self.offset += aligned_size(len(data))
+
+
+    def add(self, key, matrix, frame_map=None, best_path=None, signature=None):
+        """
+        Appends a 2-dimensional matrix, or a SparseConfMat to a sparse store, the
+        frame map of a compressed matrix, the best symbol of every frame and the
+        best value of every symbol column
+        """
+        rows, cols = matrix.shape
+        if isinstance(matrix, SparseConfMat) != self.sparse:
+            raise ValueError(f"a {'sparse' if self.sparse else 'dense'} ConfMat store can not hold {type(matrix).__name__}")
+        if frame_map is not None:
+            self.frame_maps[key] = [self.offset, len(frame_map)]
+            self._write_array(frame_map, FRAME_MAP_DTYPE)
+        if best_path is not None:
+            self.best_paths[key] = [self.offset, len(best_path)]
+            self._write_array(best_path, BEST_PATH_DTYPE)
+        if signature is not None:
+            self.signatures[key] = [self.offset, len(signature)]
+            self._write_array(signature, self.dtype)
+        if not self.sparse:
+            self.entries[key] = [self.offset, rows, cols]
+            self._write_array(matrix, self.dtype)
+            return
+        self.entries[key] = [self.offset, rows, cols, matrix.nnz]
+        self._write_array(matrix.data, self.dtype)
+        self._write_array(matrix.indices, INDICES_DTYPE)
+        self._write_array(matrix.indptr, INDPTR_DTYPE)
+
+
+    def close(self):
+        """
+        Closes the data file, writes the index and moves both files to their final location
+        """
+        self.data_file.flush()
+        os.fsync(self.data_file.fileno())
+        self.data_file.close()
+        os.replace(self.data_tmp_path, self.path_prefix + DATA_SUFFIX)
+
+        index = {"version": STORE_VERSION, "dtype": self.dtype.str, "sparse": self.sparse, "data_bytes": self.offset, "entries": self.entries, "frame_maps": self.frame_maps, "best_paths": self.best_paths, "signatures": self.signatures}
+        index_file, index_tmp_path = self._create_temp_file(INDEX_SUFFIX)
+        with index_file:
+            index_file.write(json.dumps(index).encode('utf-8'))
+            index_file.flush()
+            os.fsync(index_file.fileno())
+        os.replace(index_tmp_path, self.path_prefix + INDEX_SUFFIX)
+
+
+    def abort(self):
+        """
+        Closes and removes the temporary data file without touching an existing store
+        """
+        self.data_file.close()
+        if os.path.exists(self.data_tmp_path):
+            os.remove(self.data_tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -41,6 +41,12 @@ class KWSStats(object):
         self.overall_word_count = 0
         self.document_word_count = 0
         self.page_word_count = 0
+        self.skipped_word_count = 0 #segment and search word pairs, which can not reach the WORD_CONFIDENCE
+        self.skipped_line_count = 0 #lines, whose signature does not reach the WORD_CONFIDENCE for any search word
+        self.enumerated_combination_count = 0 #combinations of all finished enumerations, which calibrate the cost estimate
+        self.enumeration_seconds = 0.0 #runtime of all finished enumerations
+        self.degraded_by_cost_count = 0 #segment and search word pairs searched by the dp engine, because the enumeration was estimated too expensive
+        self.degraded_by_time_count = 0 #segment and search word pairs searched by the dp engine, because the time budget of the segment was exceeded
         
     
     def increment_overall_word_count(self):
@@ -52,6 +58,29 @@ class KWSStats(object):
     def increment_page_word_count(self):
         self.page_word_count = self.page_word_count + 1
         
+    def increment_skipped_word_count(self):
+        self.skipped_word_count = self.skipped_word_count + 1
+        
+    def increment_degraded_by_cost_count(self):
+        self.degraded_by_cost_count = self.degraded_by_cost_count + 1
+        
+    def increment_degraded_by_time_count(self):
+        self.degraded_by_time_count = self.degraded_by_time_count + 1
+        
+    def add_enumeration(self, combination_count, seconds):
+        self.enumerated_combination_count = self.enumerated_combination_count + combination_count
+        self.enumeration_seconds = self.enumeration_seconds + seconds
+        
+    def increment_skipped_line_count(self, segment_count, search_word_count):
+        """
+        The segments of a skipped line are counted as words, all their search word pairs as skipped
+        """
+        self.overall_word_count = self.overall_word_count + segment_count
+        self.document_word_count = self.document_word_count + segment_count
+        self.page_word_count = self.page_word_count + segment_count
+        self.skipped_word_count = self.skipped_word_count + segment_count * search_word_count
+        self.skipped_line_count = self.skipped_line_count + 1
+        
     def increment(self):
         self.increment_overall_word_count()
         self.increment_document_word_count()
@@ -30,13 +30,26 @@ Created on 22.08.2023
 
 
 import hashlib
+import math
+import os
 import numpy as np
 import logging
 import itertools
+import time
+import unicodedata
 from itertools import product
 from iui.core.KWSOptions import KWSOptions
+from iui.utils.SparseConfMat import SparseConfMat
+from iui.utils.LazyConfMat import LazyConfMat
+from iui.utils.SearchWordTrie import SearchWordTrie
 
 
+COMBINATION_BLOCK_SIZE = 4096 #number of index combinations, which are scored at once
+WILDCARD_ANY = '?' #matches one character
+WILDCARD_GAP = '*' #allows up to WILDCARD_MAX_GAP other characters
+SECONDS_PER_COMBINATION = 1.5e-7 #enumeration time of one combination, until the run has measured its own
+CALIBRATION_MIN_COMBINATIONS = 100000 #number of enumerated combinations, from which on the measured time is used
+
 
 def cells_below_threshold(matrix, threshold):
     """
@@ -245,30 +258,398 @@ def create_corrected_symbols_dict(symbols, all_query_indices):
             act_key += 1
     return corrected_symbols
 
-def split_matrix(matrix, by_col):
+def get_column_selection(symbols, all_query_indices, ctc_index, space_index):
+    """
+    This method will create the sorted array of ConfMat column indices which are kept
+    when the non-searchword characters are removed from the matrix
+    """
+    keep = set(all_query_indices)
+    keep.add(ctc_index)
+    keep.add(space_index)
+    return np.array(sorted(idx for idx in symbols if idx in keep), dtype=np.intp)
+
+
+def select_best_path(best_path, col_indices):
+    """
+    This method maps the full-alphabet best path of a line into the column selection of get_column_selection,
+    frames whose best symbol is not kept get the negative index -(symbol + 1). So the line is split at the
+    same spaces and has the same blank frames and character runs as with the full alphabet, whatever is
+    left of the other columns. The symbols dict of the selection maps these negative indices to their
+    characters, see add_unselected_symbols.
+    """
+    best_path = np.asarray(best_path, dtype=np.intp)
+    positions = np.minimum(np.searchsorted(col_indices, best_path), len(col_indices) - 1)
+    return np.where(col_indices[positions] == best_path, positions, -best_path - 1)
+
+
+def add_unselected_symbols(symbols, full_symbols, col_indices):
+    """
+    This method adds the characters outside the column selection to the symbols dict of the selection,
+    with the negative indices of select_best_path. They follow the selected symbols, so a lookup of a
+    selected character by getCharIdFromSymbols still finds its column.
+    """
+    selected = set(col_indices.tolist())
+    symbols.update({-idx - 1: char for idx, char in full_symbols.items() if idx not in selected})
+    return symbols
+
+
+def select_columns(matrix, col_indices, full_best_path=False):
+    """
+    This method keeps only the given columns of a prepared ConfMat. With full_best_path the best path is taken
+    from the full alphabet before, see select_best_path, together with the values of its cells. Returns the
+    matrix and the best path with its values, or None without full_best_path or without a selection.
+    """
+    if col_indices is None:
+        return matrix, None
+    best_path = None
+    if full_best_path:
+        best_symbols = np.argmax(matrix, axis=1)
+        best_path = (select_best_path(best_symbols, col_indices), np.asarray(matrix[np.arange(len(best_symbols)), best_symbols]))
+    return matrix[:, col_indices], best_path
+
+
+def is_search_pattern(search_word):
+    """
+    This method returns True, if the search word contains wildcards or a character class
+    """
+    return WILDCARD_ANY in search_word or WILDCARD_GAP in search_word or '[' in search_word
+
+
+def uses_all_symbols(search_words):
+    """
+    This method returns True, if one of the comma separated search words matches any character,
+    so the ConfMat columns can not be reduced to the search word characters
+    """
+    return any(WILDCARD_ANY in search_word or WILDCARD_GAP in search_word for search_word in search_words.split(','))
+
+
+def compile_search_pattern(symbols, search_word, max_gap):
+    """
+    This method compiles a search word with wildcards into a list of slots (symbol indices, gap, trailing gap). Every slot
+    matches one character, '?' any character and '[..]' one of the listed characters. The gap is the number of
+    other characters allowed in front of the slot, it is max_gap after a '*' and 0 otherwise. A '*' at the end sets
+    the trailing gap of the last slot, so up to max_gap characters behind it are allowed. Like in get_indices
+    characters, which are not in the symbols, are skipped.
+    """
+    any_symbols = [key for key, value in symbols.items() if value not in ('<ctc>', ' ')]
+    slots = []
+    gap = 0
+    search_word = search_word.strip()
+    pos = 0
+    while pos < len(search_word):
+        char = search_word[pos]
+        pos += 1
+        if char == WILDCARD_GAP:
+            gap = max_gap
+            continue
+        if char == WILDCARD_ANY:
+            slot_symbols = any_symbols
+        elif char == '[' and ']' in search_word[pos:]:
+            class_end = search_word.index(']', pos)
+            slot_symbols = [key for key, value in symbols.items() if value in search_word[pos:class_end]]
+            pos = class_end + 1
+        else:
+            slot_symbols = [key for key, value in symbols.items() if value == char]
+        if slot_symbols:
+            slots.append((slot_symbols, gap, 0))
+            gap = 0
+    if slots and gap:
+        slots[-1] = (slots[-1][0], slots[-1][1], gap)
+    return slots
+
+
+def use_equivalence_classes(options:KWSOptions):
+    """
+    This method returns True, if equivalent characters are merged into one ConfMat column
+    """
+    return bool(options.EQUIVALENCE_CLASSES or options.EQUIVALENCE_IGNORE_CASE or options.EQUIVALENCE_FOLD_DIACRITICS)
+
+
+def fold_character(char, ignore_case, fold_diacritics):
+    """
+    Returns the character without its diacritics and in lower case, if these options are set
+    """
+    if fold_diacritics:
+        char = ''.join(c for c in unicodedata.normalize('NFD', char) if not unicodedata.combining(c)) or char
+    if ignore_case:
+        char = char.lower()
+    return char
+
+
+def get_equivalence_key(char, options:KWSOptions):
+    """
+    Returns the key of the equivalence class of a character, which is the folded character or the first character
+    of its group in EQUIVALENCE_CLASSES. A character of several groups belongs to the first one.
+    """
+    key = fold_character(char, options.EQUIVALENCE_IGNORE_CASE, options.EQUIVALENCE_FOLD_DIACRITICS)
+    if options.EQUIVALENCE_CLASSES:
+        for group in options.EQUIVALENCE_CLASSES.split(','):
+            folded_group = [fold_character(c, options.EQUIVALENCE_IGNORE_CASE, options.EQUIVALENCE_FOLD_DIACRITICS) for c in group.strip()]
+            if key in folded_group:
+                return folded_group[0]
+    return key
+
+
+def get_equivalence_classes(symbols, options:KWSOptions):
+    """
+    This method groups the symbol indices by their equivalence key, <ctc> and space are never merged. Returns
+    (representative, members) of every class with more than one symbol, the representative is the lowest index.
+    """
+    classes = {}
+    for key in sorted(symbols):
+        if symbols[key] not in ('<ctc>', ' '):
+            classes.setdefault(get_equivalence_key(symbols[key], options), []).append(key)
+    return [(members[0], members) for members in classes.values() if len(members) > 1]
+
+
+def fold_search_words(symbols, search_words, options:KWSOptions):
+    """
+    This method replaces every character of the comma separated search words by the character of the representative
+    of its equivalence class, so one search covers all spelling variants. Characters without class are kept.
+    """
+    if not use_equivalence_classes(options):
+        return search_words
+    representatives = {}
+    for key in sorted(symbols):
+        if symbols[key] not in ('<ctc>', ' '):
+            representatives.setdefault(get_equivalence_key(symbols[key], options), symbols[key])
+    return ''.join(representatives.get(get_equivalence_key(char, options), char) for char in search_words)
+
+
+def pool_equivalent_columns(conf_mat, equivalence_classes, pooling="max"):
+    """
+    This method merges the raw columns of every class of equivalent symbols into the column of its representative,
+    by the maximum or by the log of the summed probabilities ("logsum"). The other columns of a class are set to the
+    matrix minimum, so they become zero by the normalization and the symbol indices stay the same.
+    """
+    matrix = np.array(conf_mat, dtype=np.float32)
+    if matrix.size == 0:
+        return matrix
+    floor = np.min(matrix)
+    for representative, members in equivalence_classes:
+        values = matrix[:, members]
+        matrix[:, representative] = np.max(values, axis=1) if pooling == "max" else np.logaddexp.reduce(values, axis=1)
+        matrix[:, members[1:]] = floor
+    return matrix
+
+
+def prepare_pooled_conf_mat(conf_mat, equivalence_classes, pooling, preparation, *preparation_args):
+    """
+    This method merges the columns of equivalent symbols by pool_equivalent_columns and runs the given
+    preparation, eg. prepare_conf_mat, on the pooled ConfMat
+    """
+    return preparation(pool_equivalent_columns(conf_mat, equivalence_classes, pooling), *preparation_args)
+
+
+def normalize_conf_mat(conf_mat, normalization_cap, normalization_power, use_normalization_cap, col_indices=None, dtype=np.float32):
+    """
+    This method normalizes a PyLaia ConfMat as a whole, instead of cell by cell.
+    The values are capped at the normalization cap, divided by the cap (or by the matrix minimum)
+    and powered, so every cell becomes (1 - max(cell, cap) / divisor) ** power.
+    If col_indices is given, only these columns are kept. The matrix minimum is always taken
+    from the full alphabet, so the kept columns have the same values as in the full matrix.
+    The result is a float32 array or a quantized array, see quantize_conf_mat.
+    """
+    matrix = np.asarray(conf_mat)
+    divisor = normalization_cap if use_normalization_cap else np.min(matrix)
+    if col_indices is not None:
+        matrix = matrix[:, col_indices]
+
+    result_matrix = np.maximum(matrix, normalization_cap, dtype=np.float64)
+    result_matrix /= divisor
+    np.subtract(1, result_matrix, out=result_matrix)
+    np.power(result_matrix, normalization_power, out=result_matrix)
+    return quantize_conf_mat(result_matrix, dtype)
+
+
+def quantize_conf_mat(matrix, dtype=np.float32):
+    """
+    Converts a normalized ConfMat with values in [0, 1] to the given dtype. For unsigned integer
+    types every cell is stored as round(value * scale), the scale is the maximum of the type
+    (255 for uint8, 65535 for uint16). A de-quantized cell differs at most 1/(2*scale) from
+    the float value and a word confidence, as mean of cells, has the same error bound.
+    Cells closer than one step may become equal, so the best path and with it the word
+    splitting and the length adjustment can differ where two symbols are nearly tied.
+    """
+    dtype = np.dtype(dtype)
+    if not np.issubdtype(dtype, np.integer):
+        return matrix.astype(dtype, copy=False)
+    scale = np.iinfo(dtype).max
+    return np.rint(np.clip(matrix, 0, 1) * scale).astype(dtype)
+
+
+def prepare_conf_mat(conf_mat, normalization_cap, normalization_power, use_normalization_cap, col_indices=None, dtype=np.float32, sparse=False, top_k=0, floor=None, compression_symbols=None, full_best_path=False):
+    """
+    This method runs all ingest steps for one PyLaia ConfMat: the normalization, the frame compression
+    (if compression_symbols, the indices of blank and space, are given), the quantization, the conversion to a
+    SparseConfMat keeping the top_k symbols per frame above the floor and at last the column selection.
+    The compressed frames and the sparse cells are chosen from the full alphabet, so every query sees
+    the same matrix. Returns the matrix, the frame map of the compression or None and the full-alphabet
+    best path of the column selection, if full_best_path is set, or None, see select_columns.
+    """
+    if compression_symbols is None and not sparse and not (full_best_path and col_indices is not None):
+        return normalize_conf_mat(conf_mat, normalization_cap, normalization_power, use_normalization_cap, col_indices, dtype), None, None
+
+    matrix = normalize_conf_mat(conf_mat, normalization_cap, normalization_power, use_normalization_cap, None, np.float64)
+    frame_map = None
+    if compression_symbols is not None:
+        matrix, frame_map = compress_frames(matrix, *compression_symbols)
+    matrix = quantize_conf_mat(matrix, dtype)
+    if sparse:
+        if floor is not None:
+            floor = floor * get_quantization_scale(matrix)
+        matrix = SparseConfMat.from_dense(matrix, top_k, floor)
+    matrix, best_path = select_columns(matrix, col_indices, full_best_path)
+    return matrix, frame_map, best_path
+
+
+def prepare_raw_conf_mat(conf_mat, col_indices=None, full_best_path=False):
+    """
+    This method keeps the raw log probabilities of a PyLaia ConfMat for the CTC posterior scoring,
+    only the columns are selected. Returns the matrix, None as frame map and the best path like prepare_conf_mat.
+    """
+    matrix, best_path = select_columns(np.asarray(conf_mat, dtype=np.float32), col_indices, full_best_path)
+    return matrix, None, best_path
+
+
+def prepare_lazy_conf_mat(conf_mat, normalization_cap, normalization_power, use_normalization_cap, col_indices=None, compression_symbols=None, full_best_path=False):
+    """
+    This method keeps the raw log probabilities of a PyLaia ConfMat in a LazyConfMat, which normalizes only the cells
+    read by the spotting. The frame compression is done on the capped raw values, the normalization keeps their order.
+    Returns the matrix, the frame map of the compression or None and the best path like prepare_conf_mat.
+    """
+    matrix = LazyConfMat.from_raw(conf_mat, normalization_cap, normalization_power, use_normalization_cap)
+    frame_map = None
+    if compression_symbols is not None:
+        raw, frame_map = compress_frames(np.maximum(matrix.raw, normalization_cap), *compression_symbols)
+        matrix = LazyConfMat(raw, matrix.divisor, normalization_cap, normalization_power)
+    matrix, best_path = select_columns(matrix, col_indices, full_best_path)
+    return matrix, frame_map, best_path
+
+
+def compress_frames(matrix, ctc_index, space_index=-1):
+    """
+    This method collapses every run of frames with the same best symbol into one max-pooled frame
+    and drops the blank runs. A blank run between two runs of the same symbol is kept as one frame,
+    so CTC decoding still yields both characters. Space frames are kept one by one, so the lines
+    are split into the same words as without compression, as long as the words are split on the
+    full alphabet (without CLEAN_NONSEARCHWORD_CHARS or with SPLIT_ON_FULL_ALPHABET). Returns the
+    compressed matrix and the frame map, which holds the first and the last original frame of every
+    compressed frame.
+    """
+    frames = matrix.shape[0]
+    if frames == 0:
+        return matrix, np.zeros((0, 2), dtype=np.int32)
+    best = np.argmax(matrix, axis=1)
+    run_starts = np.flatnonzero(np.r_[True, (best[1:] != best[:-1]) | (best[1:] == space_index)])
+    run_ends = np.r_[run_starts[1:], frames] - 1
+    run_symbols = best[run_starts]
+    
+    #the line borders count as spaces, so blank-only words are kept as well
+    keep = run_symbols != ctc_index
+    previous_symbols = np.r_[space_index, run_symbols[:-1]]
+    next_symbols = np.r_[run_symbols[1:], space_index]
+    keep |= previous_symbols == next_symbols
+    
+    compressed = np.maximum.reduceat(matrix, run_starts, axis=0)[keep]
+    frame_map = np.stack([run_starts[keep], run_ends[keep]], axis=1).astype(np.int32)
+    return compressed, frame_map
+
+
+def get_column_indices_above(mat, symbol_idx, threshold):
+    """
+    Returns the frames, whose confidence for the given symbol is above the threshold.
+    A SparseConfMat is searched directly, without building the dense column, a LazyConfMat normalizes
+    only the cells above the threshold mapped into the raw log probabilities.
+    """
+    if isinstance(mat, (SparseConfMat, LazyConfMat)):
+        return mat.get_column_indices_above(symbol_idx, threshold)
+    return np.where(mat[:, symbol_idx] > threshold)[0]
+
+
+def get_quantization_scale(matrix):
+    """
+    Returns the scale of a quantized ConfMat, which is the maximum of its integer type,
+    float matrices have the scale 1
+    """
+    if np.issubdtype(matrix.dtype, np.integer):
+        return np.iinfo(matrix.dtype).max
+    return 1
+
+
+def get_column_maxima(matrix):
+    """
+    Returns the best value of every column of a ConfMat
+    """
+    if isinstance(matrix, (SparseConfMat, LazyConfMat)):
+        return matrix.column_maxima()
+    return np.max(matrix, axis=0)
+
+
+def can_reach_word_confidence(column_maxima, search_value_indexes, options:KWSOptions):
+    """
+    This method is a cheap upper bound check before any index work. No combination can score more than the mean
+    of the column maxima of the search word characters and every character needs a frame above the character threshold.
+    The sums are built like in calculate_confidence_for_occurrences, so the bound is never below a combination.
+    """
+    if len(search_value_indexes) == 0:
+        return False
+    maxima = column_maxima[search_value_indexes]
+    scale = get_quantization_scale(maxima)
+    if scale == 1:
+        return bool(np.all(maxima > options.CHARACTER_TRESHOLD) and np.sum(maxima) / len(maxima) > options.WORD_CONFIDENCE)
+    return bool(np.all(maxima > math.floor(options.CHARACTER_TRESHOLD * scale)) and np.sum(maxima, dtype=np.int64) > math.floor(options.WORD_CONFIDENCE * scale * len(maxima)))
+
+
+def get_character_threshold(word_length, word_confidence):
     """
-    This method will split a matrix into 2 matrices at given column index
+    Returns the lowest character confidence, with which a word of the given length can still reach the word confidence
     """
-    array = np.array(matrix)
+    return max(word_confidence * word_length - (word_length - 1), 0)
+
+
+def can_line_reach_word_confidence(signature, search_value_indexes, options:KWSOptions):
+    """
+    The signature of a line holds the best value of every symbol column of the whole line, so it bounds every
+    segment of the line. The character threshold is determined by the search word length like in the spotting.
+    """
+    options.CHARACTER_TRESHOLD = get_character_threshold(len(search_value_indexes), options.WORD_CONFIDENCE)
+    return can_reach_word_confidence(signature, search_value_indexes, options)
+
+
+def get_segment_bounds(matrix_max_indices, by_col):
+    """
+    This method returns the (start, stop) frames of the sub matrices in front of every frame,
+    whose best symbol is the given column index
+    """
+    one_indices = np.flatnonzero(np.asarray(matrix_max_indices) == by_col)
+    return list(zip(np.r_[0, one_indices[:-1] + 1].tolist(), one_indices.tolist()))
+
+
+def split_matrix(matrix, by_col, matrix_max_indices=None):
+    """
+    This method will split a matrix into 2 matrices at given column index.
+    The sub matrices are slices, a SparseConfMat is split without densifying it.
+    An already computed best symbol per frame can be given.
+    """
+    array = matrix if isinstance(matrix, (SparseConfMat, LazyConfMat)) else np.array(matrix)
     
-    matrix_max_indices = np.argmax(matrix, axis=1)
-    one_indices = [index for index, item in enumerate(matrix_max_indices) if item == by_col]
+    if matrix_max_indices is None:
+        matrix_max_indices = np.argmax(matrix, axis=1)
     
     sub_matrices = []
-    prev_index = 0
-    
-    for index in one_indices:
+    for prev_index, index in get_segment_bounds(matrix_max_indices, by_col):
         sub_matrix = array[prev_index:index, :]
         sub_matrices.append(sub_matrix)
-        prev_index = index + 1
     
     
     return sub_matrices
 
 
-def extract_string_by_indices(mat, symbols, cols, rows, do_ctc_decode = True):
+def extract_string_by_indices(mat, symbols, cols, rows, do_ctc_decode = True, values = None):
     """
-    creates a string by the symbol mapping and collects confidecne values from confmat for given array of character indices
+    creates a string by the symbol mapping and collects confidecne values from confmat for given array of character indices,
+    the values of the cells can be given instead, eg. for a full-alphabet best path with characters outside the matrix
     """
     res = ''.join(symbols[i] for i in rows)
     if do_ctc_decode:
@@ -281,11 +662,13 @@ def extract_string_by_indices(mat, symbols, cols, rows, do_ctc_decode = True):
         logging.debug("this line has only <ctc> chars, skipping")
         return ['<ctc>', 1.0, 1.0, 1.0]
     cols_filtered, rows_filtered = zip(*[elem for elem in colrows if elem[1] != 0])
-    temp_vals = mat[cols_filtered, rows_filtered]
-    confidence_sum = np.sum(temp_vals) / len(rows_filtered)
+    temp_vals = mat[cols_filtered, rows_filtered] if values is None else np.asarray(values)[list(cols_filtered)]
+    #quantized values are de-quantized here, when the result is reported
+    scale = get_quantization_scale(mat)
+    confidence_sum = np.sum(temp_vals) / len(rows_filtered) / scale
     
-    min_conf = np.min(temp_vals)
-    max_conf = np.max(temp_vals)
+    min_conf = np.min(temp_vals) / scale
+    max_conf = np.max(temp_vals) / scale
     
     #if (rows[0]==81 and rows[1]==83):
     #    print(f"Used Symbols for '{res}' ({confidence_sum}): {cols_filtered} | {rows_filtered}")
@@ -296,12 +679,13 @@ def extract_string_by_indices(mat, symbols, cols, rows, do_ctc_decode = True):
 
 
 
-def find_best(mat, symbols):
+def find_best(mat, symbols, max_row_indices=None, max_values=None):
     """
-    Get value for the best confidecnes 
+    Get value for the best confidecnes, an already computed best symbol per frame and its values can be given
     """
-    max_row_indices = np.argmax(mat, axis=1)
-    [res, confidence_sum, min_conf, max_conf] = extract_string_by_indices(mat, symbols, range(len(max_row_indices)), max_row_indices)
+    if max_row_indices is None:
+        max_row_indices = np.argmax(mat, axis=1)
+    [res, confidence_sum, min_conf, max_conf] = extract_string_by_indices(mat, symbols, range(len(max_row_indices)), max_row_indices, True, max_values)
     return [res, confidence_sum, min_conf, max_conf];
 
 
@@ -384,6 +768,207 @@ def generate_combinations(data_tuples):
     return valid_combinations
 
 
+def generate_combination_blocks(arrays, block_size = COMBINATION_BLOCK_SIZE):
+    """
+    Yields the same combinations as generate_combinations_with_rules in the same order, but as
+    blocks of up to block_size combinations, one combination per row. The arrays must be sorted.
+    """
+    if not arrays or any(len(array) == 0 for array in arrays):
+        return
+    arrays = [np.asarray(array, dtype=np.intp) for array in arrays]
+    first_values = arrays[0][::-1]
+    for start in range(0, len(first_values), block_size):
+        yield from extend_combination_block(first_values[start:start + block_size, None], arrays, block_size)
+
+
+def extend_combination_block(prefixes, arrays, block_size):
+    """
+    Appends every greater index of the next array to the prefixes, which are sorted in descending
+    lexicographic order, the greatest index first. The valid indices are found by searchsorted and
+    the block is split, if it would grow beyond block_size.
+    """
+    if prefixes.shape[1] == len(arrays):
+        yield prefixes
+        return
+    
+    next_array = arrays[prefixes.shape[1]]
+    starts = np.searchsorted(next_array, prefixes[:, -1], side='right')
+    counts = len(next_array) - starts
+    total = int(np.sum(counts))
+    if total == 0:
+        return
+    
+    if total > block_size:
+        if len(prefixes) > 1:
+            half = len(prefixes) // 2
+            yield from extend_combination_block(prefixes[:half], arrays, block_size)
+            yield from extend_combination_block(prefixes[half:], arrays, block_size)
+        else:
+            next_values = next_array[starts[0]:][::-1]
+            for start in range(0, len(next_values), block_size):
+                chunk = next_values[start:start + block_size]
+                yield from extend_combination_block(np.column_stack((np.repeat(prefixes, len(chunk), axis=0), chunk)), arrays, block_size)
+        return
+    
+    prefix_rows = np.repeat(np.arange(len(prefixes)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    next_values = next_array[len(next_array) - 1 - offsets]
+    yield from extend_combination_block(np.column_stack((prefixes[prefix_rows], next_values)), arrays, block_size)
+
+
+def score_combination_block(mat, block, rows, word_threshold):
+    """
+    Scores a block of combinations at once. Returns the confidences, or the integer sums for quantized
+    matrices, and the mask of the combinations above the word threshold.
+    """
+    scale = get_quantization_scale(mat)
+    if scale == 1:
+        comb_confs = np.sum(mat[block, rows], axis=1) / len(rows)
+        return comb_confs, comb_confs > word_threshold
+    comb_sums = np.sum(mat[block, rows], axis=1, dtype=np.int64)
+    return comb_sums, comb_sums > math.floor(word_threshold * scale * len(rows))
+
+
+def find_best_combination_dp(mat, data_tuples):
+    """
+    Finds the combination of strictly increasing frame indices with the highest confidence sum by
+    dynamic programming instead of enumerating all combinations. For every character the best sum of
+    the remaining characters is taken from the suffix maxima of the next character, found by searchsorted,
+    so the runtime is O(candidates * log(candidates)). On ties the lexicographically largest combination
+    wins, which is the one generate_combinations_with_rules yields first. Returns the frame indices or None.
+    """
+    if not data_tuples or any(len(array) == 0 for _, array in data_tuples):
+        return None
+    
+    frames = [np.sort(np.asarray(array, dtype=np.intp)) for _, array in data_tuples]
+    values = [np.asarray(mat[char_frames, key], dtype=np.float64) for char_frames, (key, _) in zip(frames, data_tuples)]
+    
+    #scores[j][i]: best sum of the characters j.. if character j is at frames[j][i]
+    scores = [None] * len(frames)
+    scores[-1] = values[-1]
+    for j in range(len(frames) - 2, -1, -1):
+        suffix_max = np.r_[np.maximum.accumulate(scores[j + 1][::-1])[::-1], -np.inf]
+        scores[j] = values[j] + suffix_max[np.searchsorted(frames[j + 1], frames[j], side='right')]
+    
+    comb = []
+    previous_frame = -1
+    for j in range(len(frames)):
+        start = np.searchsorted(frames[j], previous_frame, side='right')
+        candidate_scores = scores[j][start:]
+        best_score = np.max(candidate_scores)
+        if best_score == -np.inf:
+            return None
+        #the last position with the best score is the largest frame index
+        pos = start + len(candidate_scores) - 1 - np.argmax(candidate_scores[::-1] == best_score)
+        previous_frame = frames[j][pos]
+        comb.append(previous_frame)
+    return comb
+
+
+def find_k_best_combinations_dp(mat, data_tuples, k):
+    """
+    Finds the combinations of strictly increasing frame indices of the k spans, from the frame of the first to the frame
+    of the last character, with the highest confidence sums, best first. Combinations, which only differ inside a span,
+    are alignments of the same occurrence, only the best of them is kept. The suffix sums of find_best_combination_dp
+    are computed for every frame of the last character at once, so the runtime is O(last candidates * candidates).
+    Within a span and on ties the lexicographically largest combination wins like in find_best_combination_dp.
+    """
+    if k == 1:
+        best_comb = find_best_combination_dp(mat, data_tuples)
+        return [best_comb] if best_comb is not None else []
+    if not data_tuples or any(len(array) == 0 for _, array in data_tuples):
+        return []
+    
+    frames = [np.sort(np.asarray(array, dtype=np.intp)) for _, array in data_tuples]
+    values = [np.asarray(mat[char_frames, key], dtype=np.float64) for char_frames, (key, _) in zip(frames, data_tuples)]
+    last_count = len(frames[-1])
+    
+    #scores[j][e, i]: best sum of the characters j.. if character j is at frames[j][i] and the last one at frames[-1][e]
+    scores = [None] * len(frames)
+    scores[-1] = np.where(np.eye(last_count, dtype=bool), values[-1], -np.inf)
+    for j in range(len(frames) - 2, -1, -1):
+        suffix_max = np.hstack([np.maximum.accumulate(scores[j + 1][:, ::-1], axis=1)[:, ::-1], np.full((last_count, 1), -np.inf)])
+        scores[j] = values[j] + suffix_max[:, np.searchsorted(frames[j + 1], frames[j], side='right')]
+    
+    #the spans of the k best sums and their ties are aligned, the ties are ordered by their combinations
+    span_scores = scores[0]
+    valid_scores = span_scores[np.isfinite(span_scores)]
+    if len(valid_scores) == 0:
+        return []
+    kth_score = np.partition(valid_scores, len(valid_scores) - min(k, len(valid_scores)))[len(valid_scores) - min(k, len(valid_scores))]
+    ranked = []
+    for last_pos, first_pos in np.argwhere(span_scores >= kth_score):
+        comb = [frames[0][first_pos]]
+        for j in range(1, len(frames)):
+            start = np.searchsorted(frames[j], comb[-1], side='right')
+            candidate_scores = scores[j][last_pos, start:]
+            #the last position with the best score is the largest frame index
+            pos = start + len(candidate_scores) - 1 - np.argmax(candidate_scores[::-1] == np.max(candidate_scores))
+            comb.append(frames[j][pos])
+        ranked.append((span_scores[last_pos, first_pos], comb))
+    ranked.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    return [comb for _, comb in ranked[:k]]
+
+
+def find_best_combinations_trie(mat, trie, char_threshold, non_ctc_frames, last_frame_limit):
+    """
+    Finds the best combination of every search word in the trie like find_best_combination_dp, but all search
+    words are aligned in one walk over the trie, so the work for a common prefix is done once. For every node
+    and candidate frame the best sum of the prefix ending in this frame is taken from the prefix maxima of the
+    parent node. On ties the lexicographically largest prefix wins, so every candidate keeps the rank of its prefix.
+    This is the tie rule of find_best_combination_dp, but the sums are added up from the first character on, so on
+    float matrices a sum may be rounded to a tie (or out of one) where the suffix sums of the dp are not, then
+    another combination with the same confidence is returned. The last character of a search word must be in a
+    frame below last_frame_limit. Returns a dict of the word ids to the frame indices of their best combination,
+    search words without combination are missing.
+    """
+    results = {}
+    #a state is (frames, scores, ranks, previous positions, parent state) of one node
+    stack = [(child, None) for child in trie.root.children.values()]
+    while stack:
+        node, parent = stack.pop()
+        frames = np.asarray(get_column_indices_above(mat, node.symbol_idx, char_threshold), dtype=np.intp)
+        if non_ctc_frames is not None:
+            frames = frames[non_ctc_frames[frames]]
+        if len(frames) == 0:
+            continue
+        values = np.asarray(mat[frames, node.symbol_idx], dtype=np.float64)
+        
+        if parent is None:
+            scores = values
+            ranks = np.arange(len(frames))
+            previous = np.full(len(frames), -1)
+        else:
+            parent_frames, parent_scores, parent_ranks = parent[:3]
+            #running maximum of the parent candidates ordered by score and rank
+            order = np.lexsort((parent_ranks, parent_scores))
+            keys = np.empty(len(order), dtype=np.intp)
+            keys[order] = np.arange(len(order))
+            best_keys = np.maximum.accumulate(keys)
+            counts = np.searchsorted(parent_frames, frames, side='left')
+            previous = np.where(counts > 0, order[best_keys[np.maximum(counts - 1, 0)]], -1)
+            scores = np.where(previous >= 0, values + parent_scores[previous], -np.inf)
+            ranks = np.empty(len(frames), dtype=np.intp)
+            ranks[np.lexsort((frames, np.where(previous >= 0, parent_ranks[previous], -1)))] = np.arange(len(frames))
+        
+        state = (frames, scores, ranks, previous, parent)
+        if node.word_ids:
+            eligible = np.flatnonzero((frames < last_frame_limit) & (scores > -np.inf))
+            if len(eligible) > 0:
+                pos = eligible[np.lexsort((ranks[eligible], scores[eligible]))[-1]]
+                comb = []
+                backtrack_state = state
+                while backtrack_state is not None:
+                    comb.insert(0, backtrack_state[0][pos])
+                    pos = backtrack_state[3][pos]
+                    backtrack_state = backtrack_state[4]
+                for word_id in node.word_ids:
+                    results[word_id] = comb
+        if np.any(scores > -np.inf):
+            stack.extend((child, state) for child in node.children.values())
+    return results
+
+
 def add_result_with_conditions_old(results, act_key, comb, comb_conf, asstring):
     """
     Adding result to result array, but filter redundant information
@@ -401,13 +986,13 @@ def add_result_with_conditions_old(results, act_key, comb, comb_conf, asstring):
         results[existing_index] = {'at': act_key, 'comb': comb, 'confidence': comb_conf, 'asstring': asstring}
 
 
-def add_result_with_conditions(results, act_key, comb, comb_conf, mat, symbols, cols, rows, options:KWSOptions):
+def add_result_with_conditions(results, act_key, comb, comb_conf, mat, symbols, cols, rows, options:KWSOptions, rank = None):
     """
-    Insert result in respect to the confidecne
+    Insert result in respect to the confidecne, results with a rank are kept apart from the other ranks
     """
     #key = f"{act_key}_{asstring[0]}"
     asstring = extract_string_by_indices(mat, symbols, cols, rows, False)   
-    key = (act_key, asstring[0])
+    key = (act_key, asstring[0]) if rank is None else (act_key, asstring[0], rank)
     if key in results:
         existing_result = results[key]
         if comb_conf > existing_result['confidence']:
@@ -417,6 +1002,26 @@ def add_result_with_conditions(results, act_key, comb, comb_conf, mat, symbols,
         results[key] = {'at': act_key, 'comb': comb, 'confidence': comb_conf, 'asstring': asstring}
 
 
+def drop_overlapping_occurrences(occurrences):
+    """
+    Returns the occurrences of one search word in one segment without those, whose span from the first to the
+    last frame of their combination overlaps the span of a better occurrence. Overlapping spans are alignments
+    of the same occurrence, e.g. of the kbest engine, so only the best of them is a hit. On equal confidences
+    the earlier occurrence is kept.
+    """
+    kept_keys = set()
+    kept_spans = []
+    for key, occurrence in sorted(occurrences.items(), key=lambda item: item[1]['confidence'], reverse=True):
+        comb = occurrence['comb']
+        if len(comb) > 0:
+            first, last = comb[0], comb[-1]
+            if any(first <= kept_last and kept_first <= last for kept_first, kept_last in kept_spans):
+                continue
+            kept_spans.append((first, last))
+        kept_keys.add(key)
+    return {key: occurrence for key, occurrence in occurrences.items() if key in kept_keys}
+
+
 def compress_sub_sequences(seq):
     
     result = []
@@ -481,16 +1086,18 @@ def clean_ctc_double_occurances_v2(mat, res2, clean_ctc_double_occurances):
 
 
 
-def clean_ctc_cols_v1(mat, data, symbols, clean_ctc_cols):
+def clean_ctc_cols_v1(mat, data, symbols, clean_ctc_cols, non_ctc_frames=None):
     """
     In nearly all cases the CTC-Windows are the same for all words in the matrix, by removing them in beforehand we are able to reduce the number of combinations by factor of around 0.3
+    The frames, whose best symbol is no CTC blank, can be given from the line analysis.
     """
     res = []
     if clean_ctc_cols:
-        ctc_index = getCharIdFromSymbols(symbols, '<ctc>')
-        max_row_indices = np.argmax(mat, axis=1)
-        positions = np.where(max_row_indices != ctc_index)[0]
-        filtered_tuples_array = [(key, [value for value in arr if value in positions]) for key, arr in data]
+        if non_ctc_frames is None:
+            ctc_index = getCharIdFromSymbols(symbols, '<ctc>')
+            max_row_indices = np.argmax(mat, axis=1)
+            non_ctc_frames = max_row_indices != ctc_index
+        filtered_tuples_array = [(key, np.asarray(arr, dtype=np.intp)[non_ctc_frames[np.asarray(arr, dtype=np.intp)]]) for key, arr in data]
         res = filtered_tuples_array
     else:
         res = data
@@ -541,16 +1148,21 @@ def clean_ctc_double_occurances_v1(mat, res2, clean_ctc_double_occurances):
     return res3
     
 
-def clean_indices_rules(mat, indices_arrays, symbols, options:KWSOptions):
+def clean_indices_rules(mat, indices_arrays, symbols, options:KWSOptions, segment=None):
     """
     These rules will remove unpossible index combinations in beforehand. for example: Char n must have an greater index than char n-1, and same for above.
+    The CTC frames are taken from the segment analysis, if it is given.
     """
     
     clean_lower_indices = True
     clean_higher_indices = True
+    #compressed ConfMats have no trailing blank frame, so the last frame may be used as well
+    frame_slack = 1 if options.FRAME_COMPRESSION else 0
 
     
     #clean lower indices, because if following arrays contain indices that are lower than the previous array's lowest element, it will never be used, so we kill it away
+    #the index arrays are sorted, so the bounds are found by searchsorted
+    indices_arrays = [(key, np.asarray(sub_array, dtype=np.intp)) for key, sub_array in indices_arrays]
     res = []
     previous_array = []
     if clean_lower_indices:
@@ -562,8 +1174,8 @@ def clean_indices_rules(mat, indices_arrays, symbols, options:KWSOptions):
                 if (len(previous_array) == 0):
                     return []
                 else:
-                    minelem = min(previous_array)
-                    filtered_array = [x for x in sub_array if x > minelem]
+                    minelem = previous_array[0]
+                    filtered_array = sub_array[np.searchsorted(sub_array, minelem, side='right'):]
                     
                     if len(filtered_array) == 0:
                         return []
@@ -580,8 +1192,8 @@ def clean_indices_rules(mat, indices_arrays, symbols, options:KWSOptions):
     pos = 0
     if clean_higher_indices:
         for key, sub_array in res:
-            maxelem = mat.shape[0] - (len(indices_arrays) - pos)
-            filtered_array = [x for x in sub_array if x < maxelem]
+            maxelem = mat.shape[0] - (len(indices_arrays) - pos) + frame_slack
+            filtered_array = sub_array[:np.searchsorted(sub_array, maxelem, side='left')]
             
             if len(filtered_array) == 0:
                 return []
@@ -591,13 +1203,13 @@ def clean_indices_rules(mat, indices_arrays, symbols, options:KWSOptions):
     else:
         res2 = res
 
-    res3 = clean_ctc_cols_v1(mat, res2, symbols, options.CLEAN_CTC_COLS) 
+    res3 = clean_ctc_cols_v1(mat, res2, symbols, options.CLEAN_CTC_COLS, segment.non_ctc_frames if segment is not None else None) 
 
     #res3 = clean_ctc_double_occurances_v1(mat, res2, clean_ctc_double_occurances)
     res4 = clean_ctc_double_occurances_v2(mat, res3, options.CLEAN_CTC_DOUBLE_CHARACTERS)
     
             
-    return res4;
+    return [(key, np.asarray(sub_array, dtype=np.intp)) for key, sub_array in res4];
 
 def count_indices_combination_size(indices_arrays):
     """
@@ -607,6 +1219,32 @@ def count_indices_combination_size(indices_arrays):
     for _, sub_array in indices_arrays:
         prod = prod * len(sub_array)
     return prod
+
+
+def count_increasing_combinations(indices_arrays):
+    """
+    Calculates the number of combinations with strictly increasing frame indices, which generate_combination_blocks
+    yields. The count of a frame is the sum of the counts of the greater frames of the next character, it is summed
+    as float, so it does not overflow for long words.
+    """
+    if not indices_arrays or any(len(sub_array) == 0 for _, sub_array in indices_arrays):
+        return 0.0
+    arrays = [np.sort(np.asarray(sub_array, dtype=np.intp)) for _, sub_array in indices_arrays]
+    counts = np.ones(len(arrays[-1]), dtype=np.float64)
+    for j in range(len(arrays) - 2, -1, -1):
+        suffix_sums = np.r_[np.cumsum(counts[::-1])[::-1], 0.0]
+        counts = suffix_sums[np.searchsorted(arrays[j + 1], arrays[j], side='right')]
+    return float(np.sum(counts))
+
+
+def estimate_enumeration_seconds(combination_count, stats=None):
+    """
+    Estimates the runtime of the enumeration of the given number of combinations. The time per combination is
+    calibrated by the enumerations measured in the run statistics, before that SECONDS_PER_COMBINATION is used.
+    """
+    if stats is not None and stats.enumerated_combination_count >= CALIBRATION_MIN_COMBINATIONS:
+        return combination_count * stats.enumeration_seconds / stats.enumerated_combination_count
+    return combination_count * SECONDS_PER_COMBINATION
         
     
 
@@ -625,9 +1263,12 @@ def get_wildcard_indices(symbols):
     
 
     
-def calculate_confidence_for_occurrences(mat, act_key, search_value_indexes, symbols, options:KWSOptions):
+def calculate_confidence_for_occurrences(mat, act_key, search_value_indexes, symbols, options:KWSOptions, segment=None, search_engine=None, stats=None):
     """
-    This method uses the combinations indices to calculate the confidence value from the ConfMat
+    This method uses the combinations indices to calculate the confidence value from the ConfMat,
+    the best path of the segment analysis is reused, if it is given. The search engine of the
+    options can be replaced by the given one. An enumeration, which exceeds the INDICES_LIMIT or
+    the time budget of the segment, is degraded to the dp engine and counted in the stats.
     """
     
     #debug
@@ -635,57 +1276,392 @@ def calculate_confidence_for_occurrences(mat, act_key, search_value_indexes, sym
     #    print("Here")
     
     
-    #read options
-    char_threshold = options.CHARACTER_TRESHOLD
+    #read options, for quantized matrices the character threshold is moved into the integer domain
+    scale = get_quantization_scale(mat)
+    char_threshold = options.CHARACTER_TRESHOLD if scale == 1 else math.floor(options.CHARACTER_TRESHOLD * scale)
     word_threshold = options.WORD_CONFIDENCE
     max_indices = options.INDICES_LIMIT
     stop_on_limit_exceed = options.STOP_ON_LIMIT_EXCEED
+    search_engine = search_engine if search_engine else options.SEARCH_ENGINE
+    deadline = segment.deadline if segment is not None else None
+    enumeration_start = None
     
     #prepare final result object
     results = {}
     
-    #get all possible search word character indices and apply wildcards. TODO: implementing wildcards
+    #get all possible search word character indices, search words with wildcards are handled by calculate_confidence_for_pattern
     #wildcards = get_wildcard_indices(symbols)    
     all_symbol_col_indices = []
     for symbol_idx in search_value_indexes:
-        all_symbol_col_indices.append((symbol_idx, np.where(mat[:, symbol_idx] > char_threshold)[0]))
+        all_symbol_col_indices.append((symbol_idx, get_column_indices_above(mat, symbol_idx, char_threshold)))
     
     #clean indices to reduce number of results
-    all_symbol_col_indices = clean_indices_rules(mat, all_symbol_col_indices, symbols, options)
-    
-    #count indices to determine runtime
-    true_count = count_indices_combination_size(all_symbol_col_indices)
-    
-    #check indices limit
-    #print(f"TrueCount: {true_count}")
-    if true_count > max_indices:
-        logging.debug(f"MAX_INDICES overflow: {true_count}")
-        if stop_on_limit_exceed:
-            logging.debug(f"skipping this word!")
+    all_symbol_col_indices = clean_indices_rules(mat, all_symbol_col_indices, symbols, options, segment)
+    
+    if search_engine in ("dp", "trie"):
+        #the dp engine only scores the best combination, its runtime is linear, so the indices limit does not apply
+        best_comb = find_best_combination_dp(mat, all_symbol_col_indices)
+        combination_blocks = [np.array([best_comb], dtype=np.intp)] if best_comb is not None else []
+    elif search_engine == "kbest":
+        #the best combinations of the LIMIT_RESULTS best spans are reported as alternative alignments of the segment
+        all_combinations = find_k_best_combinations_dp(mat, all_symbol_col_indices, max(options.LIMIT_RESULTS, 1))
+        combination_blocks = [np.array(all_combinations, dtype=np.intp)] if all_combinations else []
+    else:
+        #count the increasing combinations, which are enumerated, to determine runtime
+        true_count = count_increasing_combinations(all_symbol_col_indices)
+        
+        #check indices limit and time budget
+        #print(f"TrueCount: {true_count}")
+        if true_count > max_indices and stop_on_limit_exceed:
+            logging.debug(f"MAX_INDICES overflow: {true_count}, skipping this word!")
             #raise Exception(f"Indices Limit reached: {true_count}")
             return {} 
-    
-    
-    #create all possible combinations from found indices
-    all_combinations =   generate_combinations(all_symbol_col_indices)
+        if true_count > max_indices or (deadline is not None and time.perf_counter() + estimate_enumeration_seconds(true_count, stats) > deadline):
+            #the dp engine finds the same best combination in linear time
+            logging.debug(f"enumeration of {true_count} combinations is too expensive, using the dp engine")
+            if stats is not None:
+                stats.increment_degraded_by_cost_count()
+            best_comb = find_best_combination_dp(mat, all_symbol_col_indices)
+            combination_blocks = [np.array([best_comb], dtype=np.intp)] if best_comb is not None else []
+        else:
+            #create all possible combinations from found indices
+            combination_blocks = generate_combination_blocks([array for _, array in all_symbol_col_indices])
+            enumeration_start = time.perf_counter()
     
     #calculate confidences for found combinations and add results
+    #quantized matrix: the integer sums are compared to an integer threshold, only hits are de-quantized
     rows = [tup[0] for tup in all_symbol_col_indices]
-    for comb in all_combinations:
-        cols = [tup for tup in comb]
-        comb_conf = np.sum(mat[cols, rows]) / len(cols)
-        
-        
-        if (comb_conf > word_threshold):
-            add_result_with_conditions(results, act_key, comb, comb_conf, mat, symbols, cols, rows, options);
-
-    if options.DEBUG:
+    ranked = search_engine == "kbest"
+    best_comb = None
+    best_value = None
+    for block in combination_blocks:
+        if enumeration_start is not None and deadline is not None and time.perf_counter() > deadline:
+            #over the time budget the dp engine finds the best combination of all, also of the blocks already scored
+            logging.debug(f"time budget of {act_key} exceeded, using the dp engine")
+            if stats is not None:
+                stats.increment_degraded_by_time_count()
+            enumeration_start = None
+            best_comb = None
+            best_value = None
+            dp_comb = find_best_combination_dp(mat, all_symbol_col_indices)
+            if dp_comb is not None:
+                block = np.array([dp_comb], dtype=np.intp)
+                comb_values, hits = score_combination_block(mat, block, rows, word_threshold)
+                if hits[0]:
+                    best_comb = list(block[0])
+                    best_value = comb_values[0]
+            break
+        comb_values, hits = score_combination_block(mat, block, rows, word_threshold)
+        if ranked:
+            for rank in np.flatnonzero(hits):
+                cols = list(block[rank])
+                comb_conf = comb_values[rank] if scale == 1 else int(comb_values[rank]) / (scale * len(cols))
+                add_result_with_conditions(results, act_key, cols, comb_conf, mat, symbols, cols, rows, options, rank)
+        elif np.any(hits):
+            #all combinations of a search word share one result key, which keeps the first best combination
+            hit_indices = np.flatnonzero(hits)
+            best_index = hit_indices[np.argmax(comb_values[hit_indices])]
+            if best_value is None or comb_values[best_index] > best_value:
+                best_comb = list(block[best_index])
+                best_value = comb_values[best_index]
+    
+    if best_comb is not None:
+        comb_conf = best_value if scale == 1 else int(best_value) / (scale * len(best_comb))
+        add_result_with_conditions(results, act_key, best_comb, comb_conf, mat, symbols, best_comb, rows, options)
+    
+    #the measured enumerations calibrate the cost estimate of the run
+    if enumeration_start is not None and stats is not None:
+        stats.add_enumeration(true_count, time.perf_counter() - enumeration_start)
+
+    if options.DEBUG and enumeration_start is not None:
         all_combinations_list = list(generate_combinations(all_symbol_col_indices))
         logging.debug(f"combinations found: {len(all_combinations_list)}, dismissed: {len(all_combinations_list) - len(results)}" )
     
     return results
+
+
+def calculate_confidence_for_trie(mat, act_key, search_words, symbols, options:KWSOptions, segment=None):
+    """
+    This method spots a list of (word id, search value indexes, word options) at once, the word options hold the
+    word confidence of the search word, eg. raised by a ranking. The search words are grouped by their character
+    threshold and every group is compiled into a SearchWordTrie, which is walked once per segment. The hits and their
+    confidences are those of calculate_confidence_for_occurrences with the dp engine. The prefix sums are added up
+    in another order than the suffix sums of the dp engine, so where the sums of two alignments only differ by rounding,
+    the other alignment of the same confidence may be reported. The results are returned as dict of word ids to the
+    results of the search word.
+    """
+    scale = get_quantization_scale(mat)
+    non_ctc_frames = None
+    if options.CLEAN_CTC_COLS:
+        non_ctc_frames = segment.non_ctc_frames if segment is not None else np.argmax(mat, axis=1) != getCharIdFromSymbols(symbols, '<ctc>')
+    #compressed ConfMats have no trailing blank frame, so the last frame may be used as well
+    last_frame_limit = mat.shape[0] - 1 + (1 if options.FRAME_COMPRESSION else 0)
+    
+    tries = {}
+    for word_id, search_value_indexes, word_options in search_words:
+        char_threshold = get_character_threshold(len(search_value_indexes), word_options.WORD_CONFIDENCE)
+        tries.setdefault(char_threshold, SearchWordTrie()).add(word_id, search_value_indexes)
+    
+    word_results = {word_id: {} for word_id, _, _ in search_words}
+    search_words_by_id = {word_id: (search_value_indexes, word_options) for word_id, search_value_indexes, word_options in search_words}
+    for char_threshold, trie in tries.items():
+        combs = find_best_combinations_trie(mat, trie, char_threshold if scale == 1 else math.floor(char_threshold * scale), non_ctc_frames, last_frame_limit)
+        for word_id, comb in combs.items():
+            search_value_indexes, word_options = search_words_by_id[word_id]
+            rows = list(search_value_indexes)
+            comb_values, hits = score_combination_block(mat, np.array([comb], dtype=np.intp), rows, word_options.WORD_CONFIDENCE)
+            if hits[0]:
+                comb_conf = comb_values[0] if scale == 1 else int(comb_values[0]) / (scale * len(comb))
+                add_result_with_conditions(word_results[word_id], act_key, comb, comb_conf, mat, symbols, comb, rows, word_options)
+    
+    return word_results
+    
+    
+
+def ctc_log_posterior(log_probs, labels, blank_index):
+    """
+    Returns the log probability of the label sequence for all frames of the log probabilities, computed
+    by the CTC forward recursion. The states are the labels with a blank in front, in between and at the end,
+    every frame updates all states at once. The frames depend on each other, a scan over frames would need
+    products of state x state matrices, which are slower and underflow outside of log space, so the frames
+    are looped over with four in-place operations each. The states are kept behind two -inf cells, so the
+    previous states are views of the same buffer.
+    """
+    if log_probs.shape[0] == 0:
+        return -np.inf
+    states = np.full(2 * len(labels) + 1, blank_index)
+    states[1::2] = labels
+    state_log_probs = np.asarray(log_probs[:, states], dtype=np.float64)
+    #a blank may only be skipped between two different labels
+    skip_log_probs = np.full(len(states), -np.inf)
+    skip_log_probs[2:] = np.where((states[2:] != blank_index) & (states[2:] != states[:-2]), 0.0, -np.inf)
+    
+    padded_alpha = np.full(len(states) + 2, -np.inf)
+    alpha, from_previous, from_skip = padded_alpha[2:], padded_alpha[1:-1], padded_alpha[:-2]
+    alpha[:2] = state_log_probs[0, :2]
+    summed = np.empty(len(states))
+    skipped = np.empty(len(states))
+    for t in range(1, len(state_log_probs)):
+        np.add(from_skip, skip_log_probs, out=skipped)
+        np.logaddexp(alpha, from_previous, out=summed)
+        np.logaddexp(summed, skipped, out=summed)
+        np.add(summed, state_log_probs[t], out=alpha)
+    return np.logaddexp(alpha[-1], alpha[-2]) if len(labels) > 0 else alpha[-1]
+
+
+def calculate_ctc_posterior_for_occurrences(mat, act_key, search_value_indexes, symbols, options:KWSOptions, segment=None):
+    """
+    This method scores the search word by its CTC posterior in the segment, the probability of all alignments
+    of the search word to the frames of the raw ConfMat. No index combinations are built, so the runtime is linear
+    in frames and word length. The min and max values are the best frame probabilities of the characters.
+    """
+    results = {}
+    blank_index = segment.ctc_index if segment is not None else getCharIdFromSymbols(symbols, '<ctc>')
+    posterior = float(np.exp(ctc_log_posterior(mat, search_value_indexes, blank_index)))
+    
+    if posterior > options.WORD_CONFIDENCE:
+        char_probs = np.exp(np.asarray(mat[:, search_value_indexes], dtype=np.float64))
+        best_frames = np.argmax(char_probs, axis=0)
+        best_probs = char_probs[best_frames, np.arange(len(search_value_indexes))]
+        asstring = [''.join(symbols[i] for i in search_value_indexes), posterior, float(np.min(best_probs)), float(np.max(best_probs))]
+        results[(act_key, asstring[0])] = {'at': act_key, 'comb': list(best_frames), 'confidence': posterior, 'asstring': asstring}
+    
+    return results
+
+
+def calculate_confidence_for_pattern(mat, act_key, search_word, search_pattern, symbols, options:KWSOptions, segment=None):
+    """
+    This method spots a search word compiled by compile_search_pattern. Every slot uses the best of its symbols per frame,
+    the characters of the line are the runs of the best symbols. Consecutive slots must be in later runs without another
+    character in between, behind a '*' up to gap characters are allowed. The best alignment is found by dynamic programming
+    over all frames, which keeps only the scores of the previous slot per frame and run. The hit string contains the matched
+    characters and the characters of the gaps, a gap in front of the first or behind the last slot adds up to gap characters.
+    """
+    results = {}
+    scale = get_quantization_scale(mat)
+    char_threshold = options.CHARACTER_TRESHOLD
+    matrix = mat.toarray() if isinstance(mat, SparseConfMat) else np.asarray(mat)
+    
+    #best symbol and value of every slot in every frame
+    slot_symbols = []
+    slot_values = []
+    for symbol_ids, _, _ in search_pattern:
+        symbol_ids = np.asarray(symbol_ids)
+        values = np.asarray(matrix[:, symbol_ids], dtype=np.float64) / scale
+        best = np.argmax(values, axis=1)
+        slot_symbols.append(symbol_ids[best])
+        slot_values.append(np.where(values[np.arange(len(best)), best] > char_threshold, values[np.arange(len(best)), best], -np.inf))
+    
+    #characters between the frames a and b are the runs of non blank best symbols between the runs of a and b
+    best_symbols = segment.best_symbols if segment is not None else np.argmax(matrix, axis=1)
+    ctc_index = segment.ctc_index if segment is not None else getCharIdFromSymbols(symbols, '<ctc>')
+    run_starts = np.r_[0, np.flatnonzero(best_symbols[1:] != best_symbols[:-1]) + 1]
+    run_ids = np.cumsum(np.r_[0, best_symbols[1:] != best_symbols[:-1]])
+    run_is_char = best_symbols[run_starts] != ctc_index
+    chars_before_run = np.r_[0, np.cumsum(run_is_char)]
+    runs = np.arange(len(run_starts))
+    frames = np.arange(matrix.shape[0])
+    
+    scores = slot_values[0]
+    backtrack = []
+    for slot_index in range(1, len(search_pattern)):
+        #best score of the previous slot in every run, on ties the first frame like np.argmax
+        run_scores = np.maximum.reduceat(scores, run_starts)
+        run_frames = np.minimum.reduceat(np.where(scores == run_scores[run_ids], frames, len(frames)), run_starts)
+        #the previous slot may be in the runs first_runs[q] to q - 1 in front of the run q, the earliest run wins on ties
+        first_runs = np.searchsorted(chars_before_run[1:], chars_before_run[:-1] - search_pattern[slot_index][1], side='left')
+        window_scores = np.full(len(runs), -np.inf)
+        window_frames = np.zeros(len(runs), dtype=np.intp)
+        for distance in range(1, int(np.max(runs - first_runs)) + 1):
+            previous_runs = np.maximum(runs - distance, 0)
+            better = (runs - distance >= first_runs) & (run_scores[previous_runs] >= window_scores)
+            window_scores = np.where(better, run_scores[previous_runs], window_scores)
+            window_frames = np.where(better, run_frames[previous_runs], window_frames)
+        scores = window_scores[run_ids] + slot_values[slot_index]
+        backtrack.append(window_frames[run_ids])
+    
+    last_frame = int(np.argmax(scores)) if len(scores) > 0 else 0
+    if len(scores) == 0 or scores[last_frame] == -np.inf:
+        return results
+    comb_conf = scores[last_frame] / len(search_pattern)
+    if comb_conf > options.WORD_CONFIDENCE:
+        comb = [last_frame]
+        for previous_frames in reversed(backtrack):
+            comb.insert(0, int(previous_frames[comb[0]]))
+        
+        hit = ''
+        char_runs = np.flatnonzero(run_is_char)
+        if search_pattern[0][1] > 0:
+            hit += ''.join(symbols[best_symbols[run_starts[run]]] for run in char_runs[char_runs < run_ids[comb[0]]][-search_pattern[0][1]:])
+        for slot_index, frame in enumerate(comb):
+            if slot_index > 0 and search_pattern[slot_index][1] > 0:
+                gap_runs = range(run_ids[comb[slot_index - 1]] + 1, run_ids[frame])
+                hit += ''.join(symbols[best_symbols[run_starts[run]]] for run in gap_runs if run_is_char[run])
+            hit += symbols[slot_symbols[slot_index][frame]]
+        if search_pattern[-1][2] > 0:
+            hit += ''.join(symbols[best_symbols[run_starts[run]]] for run in char_runs[char_runs > run_ids[comb[-1]]][:search_pattern[-1][2]])
+        comb_values = [slot_values[slot_index][frame] for slot_index, frame in enumerate(comb)]
+        asstring = [hit, comb_conf, min(comb_values), max(comb_values)]
+        results[(act_key, search_word)] = {'at': act_key, 'comb': comb, 'confidence': comb_conf, 'asstring': asstring}
     
+    return results
+
+
+def get_character_runs(values, blank_index, best_symbols=None):
+    """
+    This method returns the start frame, the best symbol and the maxima of all symbols of every run of frames with
+    the same best symbol, which is not the blank. These runs are the characters the HTR reads in a segment.
+    """
+    if best_symbols is None:
+        best_symbols = np.argmax(values, axis=1)
+    run_starts = np.r_[0, np.flatnonzero(best_symbols[1:] != best_symbols[:-1]) + 1]
+    run_maxima = np.maximum.reduceat(values, run_starts, axis=0)
+    is_char = best_symbols[run_starts] != blank_index
+    return run_starts[is_char], best_symbols[run_starts[is_char]], run_maxima[is_char]
+
+
+def calculate_confidence_fuzzy(mat, act_key, search_word, search_value_indexes, symbols, options:KWSOptions, segment=None):
+    """
+    This method spots the search word with up to FUZZY_MAX_EDITS insertions, deletions and substitutions in one pass over
+    the character runs of the segment. Every search word character is read in a later run than the one before or deleted,
+    the runs between two characters read are inserted characters. The confidence of an alignment is the mean confidence of
+    the characters read and every edit multiplies it by FUZZY_EDIT_FACTOR, a deleted character reads nothing. Like
+    find_best_combination_dp the scores are computed character by character for all runs at once, they are kept per number
+    of edits and difference of read and search word characters, so the best sum of such a state also gives the best
+    confidence. The best alignment is reported with the spelling read in the segment, on ties the one ending first.
+    """
+    results = {}
+    char_threshold = options.CHARACTER_TRESHOLD
+    max_edits = options.FUZZY_MAX_EDITS
+    matrix = mat.toarray() if isinstance(mat, SparseConfMat) else mat
+    values = np.asarray(matrix, dtype=np.float64) / get_quantization_scale(mat)
+    if segment is not None:
+        run_starts, run_symbols, run_maxima = get_character_runs(values, segment.ctc_index, segment.best_symbols)
+    else:
+        run_starts, run_symbols, run_maxima = get_character_runs(values, getCharIdFromSymbols(symbols, '<ctc>'))
+    runs = len(run_starts)
+    word = np.asarray(search_value_indexes, dtype=np.intp)
+    word_length = len(word)
+    if runs == 0 or word_length == 0:
+        return results
+    
+    #confidences of a search word character found, of the character read instead and of an inserted run, -inf below the threshold
+    match_values = np.where(run_maxima[:, word] > char_threshold, run_maxima[:, word], -np.inf)
+    read_values = run_maxima[np.arange(runs), run_symbols]
+    read_values = np.where(read_values > char_threshold, read_values, -np.inf)
+    substitution_values = np.where(run_symbols[:, None] != word, read_values[:, None], -np.inf)
+    #insertion_sums[g][r]: confidence sum of the g runs behind the run r
+    insertion_sums = [np.zeros(runs)]
+    for gap in range(1, min(max_edits, runs - 1) + 1):
+        insertion_sums.append(insertion_sums[-1][:runs - gap] + read_values[gap:])
+    
+    #scores[e, max_edits + d, r]: best confidence sum of the characters up to j with e edits, which read j + 1 + d characters
+    #and the last of them in the run r, the choices keep the transition of every state for the backtracking
+    shape = (max_edits + 1, 2 * max_edits + 1, runs)
+    deletion = 2 * max_edits + 2
+    first_read = deletion + 1
+    scores = None
+    choices = []
+    for j in range(word_length):
+        next_scores = np.full(shape, -np.inf)
+        choice = np.zeros(shape, dtype=np.int8)
+        #the first character read, all characters in front of it are deleted
+        if j <= max_edits:
+            next_scores[j, max_edits - j] = match_values[:, j]
+            choice[j, max_edits - j] = first_read
+            if j < max_edits:
+                next_scores[j + 1, max_edits - j] = substitution_values[:, j]
+                choice[j + 1, max_edits - j] = first_read + 1
+        if scores is not None:
+            for gap in range(min(max_edits, runs - 1) + 1):
+                previous = scores[:max_edits + 1 - gap, :2 * max_edits + 1 - gap, :runs - gap - 1] + insertion_sums[gap][:runs - gap - 1]
+                for substituted, character_values in enumerate((match_values[gap + 1:, j], substitution_values[gap + 1:, j])):
+                    if gap + substituted > max_edits:
+                        break
+                    candidates = previous[:max_edits + 1 - gap - substituted] + character_values
+                    target = next_scores[gap + substituted:, gap:, gap + 1:]
+                    better = candidates > target
+                    target[better] = candidates[better]
+                    choice[gap + substituted:, gap:, gap + 1:][better] = 2 * gap + substituted
+            candidates = scores[:max_edits, 1:]
+            better = candidates > next_scores[1:, :2 * max_edits]
+            next_scores[1:, :2 * max_edits][better] = candidates[better]
+            choice[1:, :2 * max_edits][better] = deletion
+        scores = next_scores
+        choices.append(choice)
+    
+    read_counts = word_length + np.arange(-max_edits, max_edits + 1)
+    edit_factors = options.FUZZY_EDIT_FACTOR ** np.arange(max_edits + 1)
+    confidences = np.where(read_counts[:, None] > 0, scores / np.maximum(read_counts, 1)[:, None], -np.inf) * edit_factors[:, None, None]
+    run, edits, difference = np.unravel_index(np.argmax(confidences.transpose(2, 0, 1)), (runs,) + shape[:2])
+    comb_conf = confidences[edits, difference, run]
+    if comb_conf > options.WORD_CONFIDENCE:
+        read, read_confidences, frames = [], [], []
+        for j in range(word_length - 1, -1, -1):
+            choice = choices[j][edits, difference, run]
+            if choice == deletion:
+                edits, difference = edits - 1, difference + 1
+                continue
+            substituted = (choice - first_read) if choice >= first_read else choice % 2
+            read.append(run_symbols[run] if substituted else word[j])
+            read_confidences.append(read_values[run] if substituted else match_values[run, j])
+            frames.append(run_starts[run])
+            if choice >= first_read:
+                break
+            gap = choice // 2
+            for inserted in range(run - 1, run - gap - 1, -1):
+                read.append(run_symbols[inserted])
+                read_confidences.append(read_values[inserted])
+                frames.append(run_starts[inserted])
+            edits, difference, run = edits - gap - substituted, difference - gap, run - gap - 1
+        read.reverse()
+        read_confidences.reverse()
+        frames.reverse()
+        asstring = [''.join(symbols[i] for i in read), comb_conf, min(read_confidences), max(read_confidences)]
+        results[(act_key, search_word)] = {'at': act_key, 'comb': frames, 'confidence': comb_conf, 'asstring': asstring}
     
+    return results
+
 
 def generate_hex_hash(input_string):
     """
@@ -696,3 +1672,22 @@ def generate_hex_hash(input_string):
     sha256_hash.update(input_bytes)
     hex_hash = sha256_hash.hexdigest()
     return hex_hash
+
+
+def generate_file_hash(file_path):
+    """
+    Generates a fixed hash from the content of a file
+    """
+    sha256_hash = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            sha256_hash.update(chunk)
+    return sha256_hash.hexdigest()
+
+
+def generate_file_fingerprint(file_path):
+    """
+    Generates a cheap fingerprint of a file from its size and modification time
+    """
+    file_stat = os.stat(file_path)
+    return f"{file_stat.st_size}:{file_stat.st_mtime_ns}"
@@ -33,19 +33,17 @@ import os
 import traceback
 import csv
 import re
-import pickle
-import gc
 import numpy as np
 import xml.etree.ElementTree as ET
 from kaldiio import ReadHelper
 from .KeywordSpottingMatrixUtils import *
-from Tools.scripts.nm2def import symbols
-from pickle import FALSE
 from iui.core.KWSOptions import KWSOptions
 from iui.utils.KWSStats import KWSStats
-from numpy.f2py.auxfuncs import options
 from iui.utils.XmlUtils import XMLUtils
-from test.test_buffer import numpy_array
+from iui.utils.ConfMatStore import ConfMatStore, ConfMatStoreWriter, ConfMatColumnView, ConfMatDict, ConfMatStream
+from iui.utils.ArkIndex import ArkIndex, select_keys, ARK_INDEX_SUFFIX
+from iui.utils.LineAnalysis import LineAnalysis
+from iui.utils.TopKRanking import TopKRanking
 
 
 
@@ -66,7 +64,11 @@ class KeywordSpottingUtils(object):
         This methods reads the PyLaia and Transkribus Data needed for the 
         spotting, eg: It collects the page-xml pathes, it creates a dictionary
         from the symbols.txt and reads and normalizes the ConfMats.ark.
-        It is also capable to dump and read the normalized matrix. 
+        It is also capable to store the normalized matrices in a memory mapped
+        ConfMatStore and to read them from there. In STREAMING_MODE without a
+        store the ConfMats.ark is not read here, but line by line while spotting.
+        If a scope is set, only the lines of that scope are loaded via the ark
+        offset index and no store is created.
         """
         
         try:
@@ -103,43 +105,41 @@ class KeywordSpottingUtils(object):
             
             # Step 1: Read matrices from ARK file
             logging.debug("reading ark file ConfMats.ark")
-            query = kwsOptions.search_words
-            all_query_indices = get_indices(symbols_dict, query, kwsOptions.CLEAN_NONSEARCHWORD_CHARS)
-            if kwsOptions.CLEAN_NONSEARCHWORD_CHARS:
+            #equivalent characters are searched in the column of their class
+            query = fold_search_words(symbols_dict, kwsOptions.search_words, kwsOptions)
+            #wildcards matching any character and the fuzzy search need all columns
+            clean_nonsearchword_chars = kwsOptions.CLEAN_NONSEARCHWORD_CHARS and not (kwsOptions.USE_WILDCARDS and uses_all_symbols(query)) and not kwsOptions.FUZZY_MAX_EDITS
+            all_query_indices = get_indices(symbols_dict, query, clean_nonsearchword_chars)
+            symbols_dict_full = symbols_dict
+            if clean_nonsearchword_chars:
                 all_query_indices = merge_and_clean(all_query_indices) 
                 symbols_dict = create_corrected_symbols_dict(symbols_dict, all_query_indices) 
             
-            normalized_path = file_path+'/ConfMats_' + generate_hex_hash("".join(symbols_dict.values())) + '.dmp'
-            if kwsOptions.USE_CONFMAT_DUMP and os.path.exists(normalized_path):
-                with open(normalized_path, 'rb') as file:
-                    conf_mats_by_lineid = pickle.load(file)
+            #the store holds the full-alphabet matrices, every query only slices its columns out of it
+            col_indices = None
+            if clean_nonsearchword_chars:
+                col_indices = get_column_selection(symbols_dict_full, all_query_indices, ctc_index, space_index)
+                #the full-alphabet best paths hold the other characters with negative indices
+                if kwsOptions.SPLIT_ON_FULL_ALPHABET:
+                    symbols_dict = add_unselected_symbols(symbols_dict, symbols_dict_full, col_indices)
+            
+            #a scoped run only reuses an existing store, creating one would read the whole ark
+            has_scope = bool(kwsOptions.SCOPE_PAGE_IDS or kwsOptions.SCOPE_LINE_PATTERN or kwsOptions.SCOPE_KEY_RANGE)
+            #the lazy normalization spots the raw ConfMats.ark, so no store is used
+            conf_mat_store = None
+            if not self.use_lazy_normalization(kwsOptions):
+                conf_mat_store = self.open_confmat_store(file_path, kwsOptions, not has_scope)
+            scope_keys = None
+            if has_scope:
+                scope_keys = self.get_scope_keys(conf_mat_store if conf_mat_store is not None else self.open_ark_index(file_path), kwsOptions)
+                logging.debug(f"lines in scope: {len(scope_keys)}")
+            
+            if conf_mat_store is not None:
+                conf_mats_by_lineid = ConfMatColumnView(conf_mat_store, col_indices, scope_keys, kwsOptions.SPLIT_ON_FULL_ALPHABET)
+            elif kwsOptions.STREAMING_MODE:
+                conf_mats_by_lineid = ConfMatStream(self.read_normalized_conf_mats, file_path, kwsOptions, col_indices, scope_keys, False, True)
             else:
-                normal_max = kwsOptions.NORMALIZATION_CAP
-                conf_mats_by_lineid = {}
-                with ReadHelper('ark:'+file_path+'/ConfMats.ark') as reader:
-                    line_counter = 0
-                    for key, numpy_array_full in reader:
-                        numpy_array = numpy_array_full
-                        if kwsOptions.CLEAN_NONSEARCHWORD_CHARS:
-                            numpy_array = [[element for idx, element in enumerate(row) if idx in all_query_indices or idx == ctc_index or idx == space_index] for row in numpy_array_full ]
-                        max_val = np.min(numpy_array)
-                        normalization_cap = max_val
-                        if kwsOptions.USE_NORMALIZATION_CAP:
-                            normalization_cap = normal_max
-                        normalization_power = kwsOptions.NORMALIZATION_POWER
-                        result_matrix = [[(1 - (max(cell, normal_max) / normalization_cap))**normalization_power for cell in row] for row in numpy_array]
-                        conf_mats_by_lineid[key] = result_matrix
-                        line_counter += 1
-                        if line_counter % 100 == 0:
-                            logging.debug(f"lines normalized: {line_counter}")
-                            gc.collect()
-                if kwsOptions.CREATE_CONFMAT_DUMP:
-                    with open(normalized_path, 'wb') as file:
-                        pickle.dump(conf_mats_by_lineid, file)
-                    
-                    
-                    
-                        
+                conf_mats_by_lineid = ConfMatDict(self.read_normalized_conf_mats(file_path, kwsOptions, col_indices, scope_keys, with_best_paths = True))
             
             
             
@@ -153,24 +153,247 @@ class KeywordSpottingUtils(object):
 
         return { "xml_files": None, "conf_mats":None, "symbols_dict":None}
 
-    def spot(self, htr_in, search_value,  options:KWSOptions, stats:KWSStats = KWSStats()):
+    def open_confmat_store(self, file_path, kwsOptions:KWSOptions, allow_create = True):
         """
-        This method will start the spotting for one given page-doc read by read_page-Method
+        This method opens the normalized ConfMat store of a document, depending on
+        USE_CONFMAT_DUMP and CREATE_CONFMAT_DUMP the store is reused or created from
+        the ConfMats.ark. The best path of every line is stored as well, so the line analysis
+        of a later search can reuse it, the signature of every line is stored for the pre-filter
+        of the spotting. The access time of the store is updated for the cache eviction.
+        Returns None, if no store is used.
+        """
+        normalized_path = self.get_confmat_store_path(file_path, kwsOptions)
+        conf_mat_store = None
+        if kwsOptions.USE_CONFMAT_DUMP:
+            conf_mat_store = ConfMatStore.load(normalized_path)
+        if conf_mat_store is None and kwsOptions.CREATE_CONFMAT_DUMP and allow_create:
+            with ConfMatStoreWriter(normalized_path, self.get_conf_mat_dtype(kwsOptions), self.use_sparse_conf_mats(kwsOptions)) as store_writer:
+                for key, conf_mat, frame_map in self.read_normalized_conf_mats(file_path, kwsOptions, with_frame_maps = True):
+                    spotting_conf_mat = self.get_spotting_conf_mat(conf_mat, kwsOptions)
+                    signature = get_column_maxima(spotting_conf_mat) if spotting_conf_mat.shape[0] > 0 else None
+                    store_writer.add(key, conf_mat, frame_map, np.argmax(spotting_conf_mat, axis=1), signature)
+            conf_mat_store = ConfMatStore(normalized_path)
+        if conf_mat_store is not None:
+            conf_mat_store.touch()
+        return conf_mat_store
+
+    def get_confmat_store_path(self, file_path, kwsOptions:KWSOptions):
+        """
+        This method creates the path prefix of the normalized ConfMat store. The key is built from
+        the fingerprint of the ConfMats.ark, the hash of the symbols.txt and all normalization
+        parameters, so a changed ark or normalization never reuses a stale store.
+        """
+        key_parts = [
+            generate_file_fingerprint(file_path + '/ConfMats.ark'),
+            generate_file_hash(file_path + '/symbols.txt'),
+            f"cap={kwsOptions.NORMALIZATION_CAP}",
+            f"power={kwsOptions.NORMALIZATION_POWER}",
+            f"use_cap={kwsOptions.USE_NORMALIZATION_CAP}",
+        ]
+        #float32 stores keep their key, so existing caches stay valid
+        if kwsOptions.SCORING_MODE == "ctc_posterior":
+            key_parts.append("scoring=ctc_posterior")
+            if use_equivalence_classes(kwsOptions):
+                key_parts.append(self.get_equivalence_key_part(kwsOptions))
+            return file_path + '/ConfMats_' + generate_hex_hash("|".join(key_parts))
+        if kwsOptions.QUANTIZATION:
+            key_parts.append(f"dtype={kwsOptions.QUANTIZATION}")
+        if self.use_sparse_conf_mats(kwsOptions):
+            key_parts.append(f"sparse_top_k={kwsOptions.SPARSE_TOP_K}")
+            key_parts.append(f"sparse_floor={kwsOptions.SPARSE_FLOOR}")
+        if kwsOptions.FRAME_COMPRESSION:
+            key_parts.append("frame_compression=True")
+        if use_equivalence_classes(kwsOptions):
+            key_parts.append(self.get_equivalence_key_part(kwsOptions))
+        return file_path + '/ConfMats_' + generate_hex_hash("|".join(key_parts))
+
+    def get_spotting_conf_mat(self, conf_mat, kwsOptions:KWSOptions):
+        """
+        This method returns the ConfMat as it is spotted, dense normalized matrices are made positive,
+        raw log probabilities of the CTC posterior scoring are kept
+        """
+        if isinstance(conf_mat, np.ndarray) and kwsOptions.SCORING_MODE != "ctc_posterior":
+            return np.abs(conf_mat)
+        return conf_mat
+
+    def get_equivalence_key_part(self, kwsOptions:KWSOptions):
+        """
+        This method returns the part of the store key describing the pooled equivalence classes
+        """
+        return f"equivalence={kwsOptions.EQUIVALENCE_CLASSES}|{kwsOptions.EQUIVALENCE_IGNORE_CASE}|{kwsOptions.EQUIVALENCE_FOLD_DIACRITICS}|{kwsOptions.EQUIVALENCE_POOLING}"
+
+    def read_equivalence_classes(self, file_path, kwsOptions:KWSOptions):
+        """
+        This method reads the symbols.txt and returns the equivalence classes of its symbols, see get_equivalence_classes
+        """
+        symbols = {}
+        with open(file_path + "/symbols.txt", 'r', encoding='utf-8') as symbols_txt:
+            for line in symbols_txt:
+                char, index = line.strip().split('\t')
+                symbols[int(index)] = ' ' if char == '<space>' else char
+        return get_equivalence_classes(symbols, kwsOptions)
+
+    def read_symbol_index(self, file_path, symbol):
+        """
+        This method reads the index of a symbol like <ctc> from the symbols.txt, -1 if there is none
         """
+        with open(file_path + "/symbols.txt", 'r', encoding='utf-8') as symbols_txt:
+            for line in symbols_txt:
+                char, index = line.strip().split('\t')
+                if char == symbol:
+                    return int(index)
+        return -1
+
+    def get_conf_mat_dtype(self, kwsOptions:KWSOptions):
+        """
+        This method returns the dtype of the normalized ConfMats, float32 or the quantized type.
+        The raw ConfMats of the CTC posterior scoring are never quantized.
+        """
+        if kwsOptions.SCORING_MODE == "ctc_posterior":
+            return np.dtype(np.float32)
+        return np.dtype(kwsOptions.QUANTIZATION) if kwsOptions.QUANTIZATION else np.dtype(np.float32)
+
+    def use_sparse_conf_mats(self, kwsOptions:KWSOptions):
+        """
+        This method returns True, if the normalized ConfMats are kept as SparseConfMats
+        """
+        if kwsOptions.SCORING_MODE == "ctc_posterior":
+            return False
+        return bool(kwsOptions.SPARSE_TOP_K or kwsOptions.SPARSE_FLOOR is not None)
+
+    def use_lazy_normalization(self, kwsOptions:KWSOptions):
+        """
+        This method returns True, if the raw ConfMats are normalized lazily while spotting.
+        The raw ConfMats of the CTC posterior scoring are never normalized.
+        """
+        return kwsOptions.LAZY_NORMALIZATION and kwsOptions.SCORING_MODE != "ctc_posterior"
+
+    def open_ark_index(self, file_path):
+        """
+        This method loads the offset index of the ConfMats.ark. It is built on first use
+        and saved next to the ark, the ark fingerprint is part of the index name.
+        """
+        index_path = self.get_ark_index_path(file_path)
+        ark_index = ArkIndex.load(index_path, file_path + '/ConfMats.ark')
+        if ark_index is None:
+            ark_index = ArkIndex.build(file_path + '/ConfMats.ark')
+            ark_index.save(index_path)
+        return ark_index
+
+    def get_ark_index_path(self, file_path):
+        """
+        This method creates the path of the offset index of the ConfMats.ark
+        """
+        return file_path + '/ConfMats_' + generate_hex_hash(generate_file_fingerprint(file_path + '/ConfMats.ark')) + ARK_INDEX_SUFFIX
+
+    def get_scope_keys(self, keys, kwsOptions:KWSOptions):
+        """
+        This method restricts the given line keys to the scope set by SCOPE_PAGE_IDS,
+        SCOPE_LINE_PATTERN and SCOPE_KEY_RANGE. A key range without colon is a single key.
+        """
+        page_ids = None
+        if kwsOptions.SCOPE_PAGE_IDS:
+            page_ids = {page_id.strip() for page_id in kwsOptions.SCOPE_PAGE_IDS.split(',')}
+        key_range = None
+        if kwsOptions.SCOPE_KEY_RANGE:
+            first_key, separator, last_key = kwsOptions.SCOPE_KEY_RANGE.partition(':')
+            key_range = (first_key or None, (last_key or None) if separator else first_key)
+        return select_keys(keys, page_ids, kwsOptions.SCOPE_LINE_PATTERN, key_range)
+
+    def read_normalized_conf_mats(self, file_path, kwsOptions:KWSOptions, col_indices = None, keys = None, with_frame_maps = False, with_best_paths = False):
+        """
+        This generator reads the ConfMats.ark line by line and yields the line key
+        together with the normalized ConfMat, reduced to the given columns. If keys are
+        given, only these lines are loaded via the ark offset index. With DECODE_WORKERS
+        above one the ark is decoded and normalized in parallel chunks. With FRAME_COMPRESSION
+        the frame map of every line is yielded as third value, if with_frame_maps is set. The best path
+        follows, if with_best_paths is set, with SPLIT_ON_FULL_ALPHABET it is the full-alphabet best path
+        mapped into the columns and its values, see select_columns, otherwise None.
+        For the CTC posterior scoring the raw log probabilities are kept instead, with LAZY_NORMALIZATION
+        they are kept in a LazyConfMat. The columns of equivalent characters are merged first.
+        """
+        compression_symbols = None
+        if kwsOptions.FRAME_COMPRESSION:
+            compression_symbols = (self.read_symbol_index(file_path, '<ctc>'), self.read_symbol_index(file_path, '<space>'))
+        preparation = prepare_conf_mat
+        preparation_args = (kwsOptions.NORMALIZATION_CAP, kwsOptions.NORMALIZATION_POWER, kwsOptions.USE_NORMALIZATION_CAP, col_indices, self.get_conf_mat_dtype(kwsOptions),
+                            self.use_sparse_conf_mats(kwsOptions), kwsOptions.SPARSE_TOP_K, kwsOptions.SPARSE_FLOOR, compression_symbols, kwsOptions.SPLIT_ON_FULL_ALPHABET)
+        if kwsOptions.SCORING_MODE == "ctc_posterior":
+            preparation = prepare_raw_conf_mat
+            preparation_args = (col_indices, kwsOptions.SPLIT_ON_FULL_ALPHABET)
+        elif self.use_lazy_normalization(kwsOptions):
+            preparation = prepare_lazy_conf_mat
+            preparation_args = (kwsOptions.NORMALIZATION_CAP, kwsOptions.NORMALIZATION_POWER, kwsOptions.USE_NORMALIZATION_CAP, col_indices, compression_symbols, kwsOptions.SPLIT_ON_FULL_ALPHABET)
+        if use_equivalence_classes(kwsOptions):
+            #the columns of equivalent characters are merged in the raw ConfMat, before all other steps
+            preparation_args = (self.read_equivalence_classes(file_path, kwsOptions), kwsOptions.EQUIVALENCE_POOLING, preparation) + preparation_args
+            preparation = prepare_pooled_conf_mat
         
+        if kwsOptions.DECODE_WORKERS > 1:
+            prepared_conf_mats = self.open_ark_index(file_path).read_parallel(keys, kwsOptions.DECODE_WORKERS, preparation, preparation_args)
+        else:
+            if keys is None:
+                raw_conf_mats = ReadHelper('ark:'+file_path+'/ConfMats.ark')
+            else:
+                raw_conf_mats = self.open_ark_index(file_path).read(keys)
+            prepared_conf_mats = ((key, preparation(numpy_array, *preparation_args)) for key, numpy_array in raw_conf_mats)
         
-        res = []
+        line_counter = 0
+        for key, (conf_mat, frame_map, best_path) in prepared_conf_mats:
+            yield (key, conf_mat) + ((frame_map,) if with_frame_maps else ()) + ((best_path,) if with_best_paths else ())
+            line_counter += 1
+            if line_counter % 100 == 0:
+                logging.debug(f"lines normalized: {line_counter}")
+
+    def spot(self, htr_in, search_value,  options:KWSOptions, stats:KWSStats = KWSStats(), ranking:TopKRanking = None):
+        """
+        This method will start the spotting for one given page-doc read by read_page-Method
+        and returns all results in one list. With TOP_K the results are collected in a ranking,
+        which can be shared by the documents of a run, and its best hits per search word are returned.
+        """
+        if options.TOP_K and ranking is None:
+            ranking = TopKRanking(options.TOP_K)
+        results = list(self.iter_spot(htr_in, search_value, options, stats, ranking))
+        return ranking.get_ranked_results() if ranking is not None else results
+
+    def iter_spot(self, htr_in, search_value,  options:KWSOptions, stats:KWSStats = KWSStats(), ranking:TopKRanking = None):
+        """
+        This generator does the spotting for one given page-doc line by line and yields
+        the mapped results of every line as soon as the line is processed. If a ranking is
+        given, the results are added to it instead and its thresholds bound the search.
+        """
         
         # Read and process the file content
         conf_mats = htr_in['conf_mats']
         symbols = htr_in['symbols_dict']
         
-        #map searchword characters to given symbol indices
-        all_search_value_indexes = get_indices(symbols, search_value)
+        #map searchword characters to given symbol indices, search words with spaces are phrases of several words
+        search_value = ','.join(' '.join(search_word.split()) for search_word in search_value.split(','))
+        #equivalent characters are mapped to the column of their class, hits are read with its representative
+        folded_search_value = fold_search_words(symbols, search_value, options)
+        all_search_value_indexes = get_indices(symbols, folded_search_value)
+        search_words = [search_word.strip() for search_word in search_value.split(',')]
+        search_patterns = [compile_search_pattern(symbols, folded_word, options.WILDCARD_MAX_GAP) if options.USE_WILDCARDS and is_search_pattern(folded_word) else None for folded_word in folded_search_value.split(',')]
+        
+        #the symbol ids are looked up once per document, persisted best paths of a store are reused, with
+        #SPLIT_ON_FULL_ALPHABET the lines are split into the same words with and without the column selection
+        space_id = getCharIdFromSymbols(symbols, " ")
+        ctc_id = getCharIdFromSymbols(symbols, "<ctc>")
+        ctc_posterior = options.SCORING_MODE == "ctc_posterior"
+        get_best_path = conf_mats.get_best_path if hasattr(conf_mats, "get_best_path") else lambda key: None
+        get_signature = conf_mats.get_signature if isinstance(conf_mats, ConfMatColumnView) else lambda key: None
+        #the confidence of patterns, fuzzy search words and the CTC posterior is not bounded by the column maxima
+        bounded_words = [search_pattern is None and options.FUZZY_MAX_EDITS == 0 and not ctc_posterior for search_pattern in search_patterns]
+        #getCharIdFromSymbols falls back to the id 1, so there is always a space id to split lines and phrases at
+        word_counts = [len(search_word.split()) for search_word in search_words]
+        #the enumeration of all combinations grows exponentially with the length of a phrase, the dp engine finds the same hit
+        word_engines = ["dp" if word_count > 1 and options.SEARCH_ENGINE == "enumeration" else None for word_count in word_counts]
+        #the CTC double character cleaning depends on the word length, so the trie engine searches every word with the dp engine then
+        use_trie = options.SEARCH_ENGINE == "trie" and not options.CLEAN_CTC_DOUBLE_CHARACTERS
         
         stats.document_word_count = 0
         previous_page_id = None
-        for key in conf_mats:
+        for key, conf_mat in conf_mats.items():
             logging.debug(f"processing line: {key}")
             page_key = key.split('.')[0]
             #line_key = key.split('.')[1]
@@ -191,49 +414,107 @@ class KeywordSpottingUtils(object):
             #    continue
             
             
-            #read current conf_mat
-            conf_mat = np.abs(conf_mats[key])
+            #read current conf_mat, raw log probabilities of the CTC posterior scoring are kept
+            conf_mat = self.get_spotting_conf_mat(conf_mat, options)
             #line_best = find_best(conf_mat, symbols)
             #self.writeBest(htr_in['path'], key, line_best)
             #print(line_best)
             #print(conf_mat)
 
-            #split matrix at space locations
-            space_id = getCharIdFromSymbols(symbols, " ")
-            sub_mats = split_matrix(conf_mat, space_id)
+            #split matrix at space locations, the best path is computed once for all segments and search words
+            best_symbols, best_values = get_best_path(key) or (None, None)
+            line_analysis = LineAnalysis(conf_mat, space_id, ctc_id, best_symbols, best_values)
+            
+            #the signature of the line drops the search words, which miss a character in the whole line
+            signature = get_signature(key)
+            if signature is None and any(bounded_words) and conf_mat.shape[0] > 0:
+                signature = get_column_maxima(conf_mat)
+            #with a ranking the word confidence of a search word rises to its lowest ranked hit
+            line_words = [not bounded or signature is None or can_line_reach_word_confidence(signature, search_value_indexes, ranking.get_word_options(search_word, options) if ranking is not None else options) for search_word, bounded, search_value_indexes in zip(search_words, bounded_words, all_search_value_indexes)]
+            if not any(line_words):
+                logging.debug(f"skipping line by its signature: {key}")
+                stats.increment_skipped_line_count(sum(1 for start, stop in line_analysis.segment_bounds if stop > start), len(search_words))
+                continue
             
             line_pos = 1;
             
-            for mat in sub_mats:
+            for segment in line_analysis.segments():
+                mat = segment.matrix
                 act_key = key + '.' + str(line_pos)
                 logging.debug(f"processing line: {act_key}")
                 
                 if (mat.shape[0] != 0):
-                    best = find_best(mat, symbols)
                     stats.increment()
-                    for search_value_indexes in all_search_value_indexes:
-                        l = len(search_value_indexes)
+                    segment.start_time_budget(options.SEGMENT_TIME_BUDGET)
+                    #phrases are aligned on the window of their words starting with this segment, so every
+                    #occurrence gives one hit at its first word
+                    windows = {1: segment}
+                    column_maxima = {}
+                    searched_words = []
+                    for word_id, (search_pattern, search_value_indexes, bounded, line_word, word_count) in enumerate(zip(search_patterns, all_search_value_indexes, bounded_words, line_words, word_counts)):
+                        if word_count not in windows:
+                            windows[word_count] = line_analysis.get_phrase_window(line_pos - 1, word_count)
+                        window = windows[word_count]
+                        if window is not None and bounded and word_count not in column_maxima:
+                            column_maxima[word_count] = get_column_maxima(window.matrix)
+                        word_options = ranking.get_word_options(search_words[word_id], options) if ranking is not None else options
+                        l = len(search_pattern) if search_pattern is not None else len(search_value_indexes)
                         #automatically calculate lowest possible character threshold
-                        options.CHARACTER_TRESHOLD = max(options.WORD_CONFIDENCE * l - (l - 1), 0)
-                        logging.debug(f"min character confidence determined by word_confidence: {options.CHARACTER_TRESHOLD}")
-                
-                        if mat.shape[0] > len(search_value_indexes):
-                            valid_occurrences = calculate_confidence_for_occurrences(mat, act_key, search_value_indexes, symbols, options)
+                        word_options.CHARACTER_TRESHOLD = get_character_threshold(l, word_options.WORD_CONFIDENCE)
+                        
+                        #compressed ConfMats have no trailing blank frame, so the word may fill the whole segment
+                        #the confidence search is skipped, if the column maxima of the line or segment can not reach the thresholds
+                        if not line_word or window is None or window.matrix.shape[0] <= l - (1 if options.FRAME_COMPRESSION else 0) or (bounded and not can_reach_word_confidence(column_maxima[word_count], search_value_indexes, word_options)):
+                            stats.increment_skipped_word_count()
+                        else:
+                            searched_words.append((word_id, word_options))
+                    
+                    #the trie engine aligns all remaining search words without pattern in one walk, phrases are aligned on their own window
+                    trie_occurrences = {}
+                    if use_trie:
+                        trie_occurrences = calculate_confidence_for_trie(mat, act_key, [(word_id, all_search_value_indexes[word_id], word_options) for word_id, word_options in searched_words if bounded_words[word_id] and word_counts[word_id] == 1], symbols, options, segment)
+                    
+                    for word_id, word_options in searched_words:
+                        search_word, search_pattern, search_value_indexes = search_words[word_id], search_patterns[word_id], all_search_value_indexes[word_id]
+                        window = windows[word_counts[word_id]]
+                        word_mat = window.matrix
+                        best = window.get_best(symbols, ctc_posterior)
+                        l = len(search_pattern) if search_pattern is not None else len(search_value_indexes)
+                        word_options.CHARACTER_TRESHOLD = get_character_threshold(l, word_options.WORD_CONFIDENCE)
+                        logging.debug(f"min character confidence determined by word_confidence: {word_options.CHARACTER_TRESHOLD}")
+                        if search_pattern is not None:
+                            #patterns and fuzzy search words are aligned on the frame probabilities in the CTC posterior scoring
+                            valid_occurrences = calculate_confidence_for_pattern(np.exp(word_mat) if ctc_posterior else word_mat, act_key, search_word, search_pattern, symbols, word_options, window)
+                        elif options.FUZZY_MAX_EDITS > 0:
+                            valid_occurrences = calculate_confidence_fuzzy(np.exp(word_mat) if ctc_posterior else word_mat, act_key, search_word, search_value_indexes, symbols, word_options, window)
+                        elif ctc_posterior:
+                            valid_occurrences = calculate_ctc_posterior_for_occurrences(word_mat, act_key, search_value_indexes, symbols, word_options, window)
+                        elif word_id in trie_occurrences:
+                            valid_occurrences = trie_occurrences[word_id]
+                        else:
+                            valid_occurrences = calculate_confidence_for_occurrences(word_mat, act_key, search_value_indexes, symbols, word_options, window, word_engines[word_id], stats)
 
-                            if options.ADJUST_CONFIDENCE_BY_WORD_LENGTH:
-                                valid_occurrences = self.adjust_confidence_by_best_lenght(valid_occurrences, best, options)
-                            
-                            res.extend(self.mapResult(valid_occurrences, options, stats, htr_in, best))
+                        if options.ADJUST_CONFIDENCE_BY_WORD_LENGTH:
+                            valid_occurrences = self.adjust_confidence_by_best_lenght(valid_occurrences, best, word_options)
+                        
+                        if ranking is not None:
+                            #alignments of the same occurrence take one place in the ranking, only the hits entering it are mapped
+                            for res_key in drop_overlapping_occurrences(valid_occurrences):
+                                confidence = valid_occurrences[res_key]['confidence']
+                                if ranking.accepts(search_word, confidence):
+                                    ranking.add(search_word, confidence, self.mapResult({res_key: valid_occurrences[res_key]}, options, stats, htr_in, best)[0])
+                        else:
+                            yield from self.mapResult(valid_occurrences, options, stats, htr_in, best)
                             
-                            for res_key in valid_occurrences:
-                                #TODO: write output handler
-                                occurrence = valid_occurrences[res_key]
-                                #result_str = f"Occurrence found: {occurrence['asstring']}  with Confidence: {occurrence['confidence']} at {occurrence['at']}  for best: {best}"
-                                result_str = f"Occurrence found: {occurrence['asstring']}  at {occurrence['at']}  for best: {best}"
-                                if options.DEBUG:
-                                    logging.info(result_str)
-                                if options.PRINT_RESULTS_TO_CONSOLE:
-                                    print(result_str)
+                        for res_key in valid_occurrences:
+                            #TODO: write output handler
+                            occurrence = valid_occurrences[res_key]
+                            #result_str = f"Occurrence found: {occurrence['asstring']}  with Confidence: {occurrence['confidence']} at {occurrence['at']}  for best: {best}"
+                            result_str = f"Occurrence found: {occurrence['asstring']}  at {occurrence['at']}  for best: {best}"
+                            if options.DEBUG:
+                                logging.info(result_str)
+                            if options.PRINT_RESULTS_TO_CONSOLE:
+                                print(result_str)
                                     
                                 
 
@@ -241,8 +522,6 @@ class KeywordSpottingUtils(object):
         
         #if len(res) > 0 and options.OUTPUT_EVALUATION_CSV:
         #    self.writeCSV(htr_in['path'] + f"\\results_{options.RUN_ID}.csv", res)
-
-        return res
     
     
     def writeBest(self, path, key, line_best):
@@ -258,12 +537,40 @@ class KeywordSpottingUtils(object):
         """
         Wrapper method to create the result CSV.
         """
-        output_path = htr_in['path'] + f"\\results_{options.RUN_ID}.csv"
+        output_path = self.get_result_csv_path(htr_in, options)
         if delete_old_csv and os.path.exists(output_path):
             os.remove(output_path)
         
         if len(res) > 0 and options.OUTPUT_CSV:
             self.writeCSV(output_path, res)
+
+    def spot_to_csv(self, htr_in, search_value, options:KWSOptions, stats:KWSStats = KWSStats(), delete_old_csv = False, ranking:TopKRanking = None):
+        """
+        Streaming counterpart of spot and createFullCSV, every result is written to the
+        result CSV as soon as its line is spotted. Returns the number of results.
+        With TOP_K and the ranking of a run over several documents, the hits are ranked
+        across the whole run, so nothing is written here and the owner of the ranking
+        writes it at the end of the run. Then the number of ranked hits is returned.
+        """
+        if options.TOP_K and ranking is not None:
+            self.spot(htr_in, search_value, options, stats, ranking)
+            return len(ranking)
+        
+        output_path = self.get_result_csv_path(htr_in, options)
+        if delete_old_csv and os.path.exists(output_path):
+            os.remove(output_path)
+        
+        #without the ranking of a run the document is the run, its ranked results are only known, when it is spotted
+        results = self.spot(htr_in, search_value, options, stats) if options.TOP_K else self.iter_spot(htr_in, search_value, options, stats)
+        if not options.OUTPUT_CSV:
+            return sum(1 for _ in results)
+        return self.writeCSV(output_path, results)
+
+    def get_result_csv_path(self, htr_in, options:KWSOptions):
+        """
+        Returns the path of the result CSV for the given page-doc
+        """
+        return htr_in['path'] + f"\\results_{options.RUN_ID}.csv"
   
             
     def adjust_confidence_by_best_lenght(self, valid_occurrences, best, options:KWSOptions):
@@ -301,12 +608,7 @@ class KeywordSpottingUtils(object):
         
         res = []
         
-        utils = XMLUtils()
-        page_dict = {}
-        line_dict = {}
-        if options.OUTPUT_FORMAT_ADD_LINE_SNIPPETS:
-            page_dict = utils.createMetadataDict(htr_in["xml_files"])
-            line_dict = utils.createTextLineDict(htr_in["xml_files"])
+        page_dict, line_dict = self.get_xml_dicts(htr_in, options)
             
         
         #convert result list
@@ -368,6 +670,19 @@ class KeywordSpottingUtils(object):
         
         return res
             
+    def get_xml_dicts(self, htr_in, options:KWSOptions):
+        """
+        This method parses the page and text line dicts from the page-xml files once
+        and keeps them in the page-doc for all further results.
+        """
+        if not options.OUTPUT_FORMAT_ADD_LINE_SNIPPETS:
+            return {}, {}
+        if "page_dict" not in htr_in:
+            utils = XMLUtils()
+            htr_in["page_dict"] = utils.createMetadataDict(htr_in["xml_files"])
+            htr_in["line_dict"] = utils.createTextLineDict(htr_in["xml_files"])
+        return htr_in["page_dict"], htr_in["line_dict"]
+            
     def createSnippetEntry(self, occurrence, page_dict, line_dict):
         """
         This method will create the line snippet link for the CSV 
@@ -386,18 +701,23 @@ class KeywordSpottingUtils(object):
             
     def writeCSV(self, path, data):   
         """
-        This method will write the final CSV results
+        This method will write the final CSV results. The data may also be a generator,
+        the file is opened and the header written with the first row. Returns the number of rows.
         """
-        with open(path, mode='a', newline='', encoding='utf-8') as csv_file:
-            writer = csv.writer(csv_file)  
-            
-            header = data[0].keys()
-            writer.writerow(header)
-            
+        csv_file = None
+        row_count = 0
+        try:
             for row in data:
+                if csv_file is None:
+                    csv_file = open(path, mode='a', newline='', encoding='utf-8')
+                    writer = csv.writer(csv_file)  
+                    writer.writerow(row.keys())
                 writer.writerow(row.values())
-                
-            csv_file.close()
+                row_count += 1
+        finally:
+            if csv_file is not None:
+                csv_file.close()
+        return row_count
         
 
     def createFrequencyListFromPageDoc(self, pageDoc, kwsOptions:KWSOptions):
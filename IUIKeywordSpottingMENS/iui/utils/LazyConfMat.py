@@ -0,0 +1,178 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module contains a ConfMat, which keeps the raw log probabilities
+    of the PyLaia ConfMat and normalizes only the cells, which are read.
+    The normalization is monotonic, so thresholds are mapped into the raw
+    log probability space and checked without normalizing the matrix.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import numpy as np
+
+
+CUTOFF_MARGIN = 1e-6 #relative margin of the raw cutoff, the cells passing it are checked after the normalization
+
+
+class LazyConfMat(object):
+    '''
+    Raw ConfMat with frames as rows, whose cells are normalized on access to (1 - max(cell, cap) / divisor) ** power
+    with the same values as normalize_conf_mat. The divisor is the cap or the minimum of the full alphabet and is
+    kept, when rows or columns are selected. Like a SparseConfMat it supports shape, dtype, argmax(axis=1), row slices,
+    column selection and value lookup by mat[frames, symbols].
+    '''
+
+
+    def __init__(self, raw, divisor, normalization_cap, normalization_power):
+        '''
+        Constructor
+        '''
+        self.raw = raw
+        self.divisor = divisor
+        self.normalization_cap = normalization_cap
+        self.normalization_power = normalization_power
+        self.shape = raw.shape
+
+
+    @staticmethod
+    def from_raw(conf_mat, normalization_cap, normalization_power, use_normalization_cap):
+        """
+        Creates the matrix from a raw PyLaia ConfMat, the divisor is determined like in normalize_conf_mat
+        """
+        matrix = np.asarray(conf_mat, dtype=np.float32)
+        divisor = normalization_cap if use_normalization_cap else np.min(matrix)
+        return LazyConfMat(matrix, divisor, normalization_cap, normalization_power)
+
+
+    @property
+    def dtype(self):
+        return np.dtype(np.float32)
+
+    @property
+    def nbytes(self):
+        return self.raw.nbytes
+
+
+    def normalize(self, values):
+        """
+        Returns the normalized float32 values of the given raw values
+        """
+        result = np.maximum(values, self.normalization_cap, dtype=np.float64)
+        result /= self.divisor
+        np.subtract(1, result, out=result)
+        np.power(result, self.normalization_power, out=result)
+        return result.astype(np.float32)
+
+
+    def get_raw_cutoff(self, threshold):
+        """
+        Returns the raw value, above which the normalized value is greater than the threshold:
+        divisor * (1 - threshold ** (1 / power)), lowered by the margin for rounding
+        """
+        cutoff = self.divisor * (1 - max(threshold, 0) ** (1 / self.normalization_power))
+        return cutoff - abs(self.divisor) * CUTOFF_MARGIN
+
+
+    def get_column_indices_above(self, col, threshold):
+        """
+        Returns the frames, whose normalized value in the given symbol column is greater than the threshold.
+        Only the cells above the raw cutoff are normalized.
+        """
+        column = self.raw[:, col]
+        candidates = np.flatnonzero(np.maximum(column, self.normalization_cap) > self.get_raw_cutoff(threshold))
+        return candidates[self.normalize(column[candidates]) > threshold]
+
+
+    def argmax(self, axis = None, out = None):
+        """
+        Returns the best symbol per frame from the capped raw values, on ties the lowest column wins.
+        Raw values, which are rounded to the same normalized value, are no tie here.
+        """
+        if axis != 1:
+            raise ValueError("LazyConfMat only supports argmax(axis=1)")
+        return np.argmax(np.maximum(self.raw, self.normalization_cap), axis=1, out=out)
+
+
+    def column_maxima(self):
+        """
+        Returns the best normalized value of every symbol column, the normalization keeps the order
+        """
+        return self.normalize(np.max(self.raw, axis=0))
+
+
+    def select_rows(self, start, stop):
+        """
+        Returns the frames start to stop as new lazy matrix, the raw values are shared
+        """
+        return LazyConfMat(self.raw[start:stop, :], self.divisor, self.normalization_cap, self.normalization_power)
+
+
+    def select_columns(self, col_indices):
+        """
+        Returns a lazy matrix, which only contains the given symbol columns in the given order
+        """
+        return LazyConfMat(self.raw[:, col_indices], self.divisor, self.normalization_cap, self.normalization_power)
+
+
+    def take(self, rows, cols):
+        """
+        Returns the normalized values of the cells (rows[i], cols[i])
+        """
+        return self.normalize(self.raw[rows, cols])
+
+
+    def column(self, col):
+        """
+        Returns one normalized symbol column
+        """
+        return self.normalize(self.raw[:, col])
+
+
+    def toarray(self):
+        """
+        Returns the normalized dense matrix
+        """
+        return self.normalize(self.raw)
+
+
+    def __array__(self, dtype = None, copy = None):
+        matrix = self.toarray()
+        return matrix if dtype is None else matrix.astype(dtype, copy=False)
+
+
+    def __getitem__(self, key):
+        """
+        Supports mat[start:stop, :], mat[:, col], mat[:, col_indices] and mat[frames, symbols]
+        """
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(rows, slice) and isinstance(cols, slice):
+            if rows.step not in (None, 1) or cols != slice(None):
+                raise IndexError("LazyConfMat only supports contiguous row slices")
+            return self.select_rows(rows.start, rows.stop)
+        if isinstance(rows, slice) and rows == slice(None):
+            if np.isscalar(cols):
+                return self.column(cols)
+            return self.select_columns(cols)
+        return self.take(rows, cols)
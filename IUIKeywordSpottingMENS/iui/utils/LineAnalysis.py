@@ -0,0 +1,117 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module contains the analysis of the best path of a ConfMat line.
+    The best symbol of every frame, the segments between the spaces and
+    the CTC blank frames are computed once per line and shared by all
+    segments and search words.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import bisect
+import time
+import numpy as np
+from iui.utils.KeywordSpottingMatrixUtils import find_best, get_segment_bounds
+
+
+class LineAnalysis(object):
+    '''
+    Best path of one ConfMat line. The segments are the frames between two space frames
+    like in split_matrix, the part behind the last space is no segment. A full-alphabet best
+    path of a column selection holds negative indices for other best characters, see select_best_path,
+    its values are given then.
+    '''
+
+
+    def __init__(self, conf_mat, space_index, ctc_index, best_symbols = None, best_values = None):
+        '''
+        Constructor, the best symbols are computed from the ConfMat, if no persisted best path is given
+        '''
+        self.conf_mat = conf_mat
+        self.ctc_index = ctc_index
+        self.best_symbols = np.argmax(conf_mat, axis=1) if best_symbols is None else np.asarray(best_symbols, dtype=np.intp)
+        self.best_values = best_values
+        self.non_ctc_frames = self.best_symbols != ctc_index
+        self.segment_bounds = get_segment_bounds(self.best_symbols, space_index)
+        self.word_segments = [index for index, (start, stop) in enumerate(self.segment_bounds) if stop > start]
+
+
+    def segments(self):
+        """
+        Generator, which yields the analysis of every segment in line order
+        """
+        for start, stop in self.segment_bounds:
+            yield SegmentAnalysis(self, start, stop)
+
+
+    def get_phrase_window(self, first, word_count):
+        """
+        Returns the analysis of the frames of word_count non empty segments starting with the segment first,
+        the space frames between them are included. None, if the line has less segments behind first.
+        """
+        position = bisect.bisect_left(self.word_segments, first)
+        if position + word_count > len(self.word_segments):
+            return None
+        return SegmentAnalysis(self, self.segment_bounds[first][0], self.segment_bounds[self.word_segments[position + word_count - 1]][1])
+
+
+
+class SegmentAnalysis(object):
+    '''
+    Best path of one segment, the arrays are slices of the line analysis
+    '''
+
+
+    def __init__(self, line, start, stop):
+        '''
+        Constructor
+        '''
+        self.matrix = line.conf_mat[start:stop, :]
+        self.ctc_index = line.ctc_index
+        self.best_symbols = line.best_symbols[start:stop]
+        self.best_values = line.best_values[start:stop] if line.best_values is not None else None
+        self.non_ctc_frames = line.non_ctc_frames[start:stop]
+        self.best = None
+        self.deadline = None
+
+
+    def start_time_budget(self, seconds):
+        """
+        Starts the wall-clock budget of the segment, no deadline is set for 0 seconds
+        """
+        self.deadline = time.perf_counter() + seconds if seconds else None
+
+
+    def get_best(self, symbols, log_values = False):
+        """
+        Returns the best path string and its confidences, see find_best. Raw log probabilities
+        are turned into probabilities first.
+        """
+        if self.best is None:
+            best_values = self.best_values
+            if log_values and best_values is not None:
+                best_values = np.exp(best_values)
+            self.best = find_best(np.exp(self.matrix) if log_values else self.matrix, symbols, self.best_symbols, best_values)
+        return self.best
@@ -0,0 +1,90 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module contains a character trie of the search words. Search words
+    with a common prefix like "Johan", "Johann" and "Johannes" share the
+    nodes of the prefix, so the alignment of the prefix is computed once
+    for all of them.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+
+class SearchWordTrieNode(object):
+    '''
+    Node of the trie for one symbol index, it knows the ids of the search words ending in it
+    '''
+
+
+    def __init__(self, symbol_idx):
+        '''
+        Constructor
+        '''
+        self.symbol_idx = symbol_idx
+        self.children = {}
+        self.word_ids = []
+
+
+
+class SearchWordTrie(object):
+    '''
+    Trie of search words given as symbol indices. The root has no symbol, search words
+    without symbol indices end in the root and are never found.
+    '''
+
+
+    def __init__(self, search_words = ()):
+        '''
+        Constructor, search_words are (word id, symbol indices) pairs
+        '''
+        self.root = SearchWordTrieNode(None)
+        self.word_count = 0
+        for word_id, search_value_indexes in search_words:
+            self.add(word_id, search_value_indexes)
+
+
+    def add(self, word_id, search_value_indexes):
+        """
+        Adds a search word, the nodes of its prefixes are reused
+        """
+        node = self.root
+        for symbol_idx in search_value_indexes:
+            if symbol_idx not in node.children:
+                node.children[symbol_idx] = SearchWordTrieNode(symbol_idx)
+            node = node.children[symbol_idx]
+        node.word_ids.append(word_id)
+        self.word_count += 1
+
+
+    def node_count(self):
+        """
+        Returns the number of nodes without the root, the number of character alignments of one walk
+        """
+        count = 0
+        nodes = list(self.root.children.values())
+        while nodes:
+            node = nodes.pop()
+            count += 1
+            nodes.extend(node.children.values())
+        return count
@@ -0,0 +1,218 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module contains a sparse, CSR like representation of a normalized
+    ConfMat. Per frame only the best symbols are kept, all other cells are
+    implicit zeros. It supports the matrix operations used by the spotting.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import numpy as np
+
+
+INDICES_DTYPE = np.dtype(np.int32)
+INDPTR_DTYPE = np.dtype(np.int64)
+
+
+class SparseConfMat(object):
+    '''
+    Sparse ConfMat with frames as rows. The kept cells of frame r are data[indptr[r]:indptr[r+1]]
+    in the symbol columns indices[indptr[r]:indptr[r+1]], sorted by column. Like a numpy matrix it
+    supports shape, dtype, argmax(axis=1), row slices, column selection and value lookup by
+    mat[frames, symbols].
+    '''
+
+
+    def __init__(self, data, indices, indptr, shape):
+        '''
+        Constructor
+        '''
+        self.data = data
+        self.indices = indices
+        self.indptr = indptr
+        self.shape = tuple(shape)
+        self._entry_rows = None
+        self._entry_keys = None
+
+
+    @staticmethod
+    def from_dense(matrix, top_k = 0, floor = None):
+        """
+        Creates the sparse matrix from a dense normalized ConfMat. Per frame the top_k symbols (0 keeps
+        all) with a value of at least floor (None keeps all) are kept. The best symbol of every frame
+        is always kept, so the argmax of the frames does not change. After a column selection a frame may
+        have no cells left, it reads as column 0 then, see SPLIT_ON_FULL_ALPHABET.
+        """
+        rows_count, cols_count = matrix.shape
+        keep = np.ones(matrix.shape, dtype=bool)
+        if floor is not None:
+            keep &= matrix >= floor
+        if top_k and top_k < cols_count:
+            kth_values = np.partition(matrix, cols_count - top_k, axis=1)[:, cols_count - top_k]
+            keep &= matrix >= kth_values[:, None]
+        if rows_count > 0:
+            keep[np.arange(rows_count), np.argmax(matrix, axis=1)] = True
+
+        rows, cols = np.nonzero(keep)
+        indptr = np.zeros(rows_count + 1, dtype=INDPTR_DTYPE)
+        np.cumsum(np.count_nonzero(keep, axis=1), out=indptr[1:])
+        return SparseConfMat(matrix[rows, cols], cols.astype(INDICES_DTYPE), indptr, matrix.shape)
+
+
+    @property
+    def dtype(self):
+        return self.data.dtype
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.indices.nbytes + self.indptr.nbytes
+
+
+    def get_entry_rows(self):
+        """
+        Returns the frame of every kept cell
+        """
+        if self._entry_rows is None:
+            self._entry_rows = np.repeat(np.arange(self.shape[0], dtype=np.int64), np.diff(self.indptr))
+        return self._entry_rows
+
+
+    def get_column_indices_above(self, col, threshold):
+        """
+        Returns the frames, whose value in the given symbol column is greater than the threshold,
+        the same as np.where(mat[:, col] > threshold)[0] on the dense matrix for a threshold >= 0
+        """
+        mask = (self.indices == col) & (self.data > threshold)
+        return self.get_entry_rows()[mask]
+
+
+    def argmax(self, axis = None, out = None):
+        """
+        Returns the best symbol per frame, on ties the lowest column wins like in numpy. Frames without
+        cells get column 0.
+        """
+        if axis != 1:
+            raise ValueError("SparseConfMat only supports argmax(axis=1)")
+        res = np.zeros(self.shape[0], dtype=np.intp)
+        if self.nnz > 0:
+            rows = self.get_entry_rows()
+            row_max = np.full(self.shape[0], -np.inf)
+            np.maximum.at(row_max, rows, self.data)
+            candidates = np.flatnonzero(self.data == row_max[rows])
+            first = candidates[np.r_[True, rows[candidates][1:] != rows[candidates][:-1]]]
+            res[rows[first]] = self.indices[first]
+        if out is not None:
+            out[...] = res
+            return out
+        return res
+
+
+    def column_maxima(self):
+        """
+        Returns the best value of every symbol column, cells not kept are zero
+        """
+        res = np.zeros(self.shape[1], dtype=self.dtype)
+        np.maximum.at(res, self.indices, self.data)
+        return res
+
+
+    def select_rows(self, start, stop):
+        """
+        Returns the frames start to stop as new sparse matrix, the cells are shared
+        """
+        start, stop, _ = slice(start, stop).indices(self.shape[0])
+        stop = max(start, stop)
+        offset = self.indptr[start]
+        return SparseConfMat(self.data[offset:self.indptr[stop]], self.indices[offset:self.indptr[stop]], self.indptr[start:stop + 1] - offset, (stop - start, self.shape[1]))
+
+
+    def select_columns(self, col_indices):
+        """
+        Returns a sparse matrix, which only contains the given symbol columns in the given order
+        """
+        col_indices = np.asarray(col_indices)
+        lookup = np.full(self.shape[1], -1, dtype=np.int64)
+        lookup[col_indices] = np.arange(len(col_indices))
+        new_indices = lookup[self.indices]
+        keep = new_indices >= 0
+        rows = self.get_entry_rows()[keep]
+        new_indices = new_indices[keep]
+        order = np.lexsort((new_indices, rows))
+        indptr = np.zeros(self.shape[0] + 1, dtype=INDPTR_DTYPE)
+        np.cumsum(np.bincount(rows, minlength=self.shape[0]), out=indptr[1:])
+        return SparseConfMat(self.data[keep][order], new_indices[order].astype(INDICES_DTYPE), indptr, (self.shape[0], len(col_indices)))
+
+
+    def take(self, rows, cols):
+        """
+        Returns the values of the cells (rows[i], cols[i]), cells not kept are zero
+        """
+        rows, cols = np.broadcast_arrays(np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))
+        if self.nnz == 0:
+            return np.zeros(rows.shape, dtype=self.dtype)
+        if self._entry_keys is None:
+            self._entry_keys = self.get_entry_rows() * self.shape[1] + self.indices
+        wanted = rows * self.shape[1] + cols
+        positions = np.minimum(np.searchsorted(self._entry_keys, wanted), self.nnz - 1)
+        return np.where(self._entry_keys[positions] == wanted, self.data[positions], 0).astype(self.dtype, copy=False)
+
+
+    def column(self, col):
+        """
+        Returns one symbol column as dense array
+        """
+        res = np.zeros(self.shape[0], dtype=self.dtype)
+        mask = self.indices == col
+        res[self.get_entry_rows()[mask]] = self.data[mask]
+        return res
+
+
+    def toarray(self):
+        """
+        Returns the dense matrix
+        """
+        res = np.zeros(self.shape, dtype=self.dtype)
+        res[self.get_entry_rows(), self.indices] = self.data
+        return res
+
+
+    def __getitem__(self, key):
+        """
+        Supports mat[start:stop, :], mat[:, col], mat[:, col_indices] and mat[frames, symbols]
+        """
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        if isinstance(rows, slice) and isinstance(cols, slice):
+            if rows.step not in (None, 1) or cols != slice(None):
+                raise IndexError("SparseConfMat only supports contiguous row slices")
+            return self.select_rows(rows.start, rows.stop)
+        if isinstance(rows, slice) and rows == slice(None):
+            if np.isscalar(cols):
+                return self.column(cols)
+            return self.select_columns(cols)
+        return self.take(rows, cols)
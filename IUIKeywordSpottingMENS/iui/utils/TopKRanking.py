@@ -0,0 +1,112 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module contains the ranking of the best hits per search word of
+    a whole run. Once a search word has its number of hits, the lowest
+    kept confidence becomes its word confidence, so the remaining
+    segments are bounded and searched against a rising threshold.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import copy
+import heapq
+
+
+class TopKRanking(object):
+    '''
+    Best top_k hits of every search word, kept in one min heap per search word. On equal confidences
+    the earlier hit is ranked first and kept.
+    '''
+
+
+    def __init__(self, top_k):
+        '''
+        Constructor
+        '''
+        self.top_k = top_k
+        self.heaps = {}
+        self.hit_count = 0
+
+
+    def get_threshold(self, search_word):
+        """
+        Returns the confidence a new hit of the search word has to exceed, None while it has less than top_k hits
+        """
+        heap = self.heaps.get(search_word)
+        return heap[0][0] if heap is not None and len(heap) >= self.top_k else None
+
+
+    def get_word_options(self, search_word, options):
+        """
+        Returns a copy of the options with the WORD_CONFIDENCE raised to the threshold of the search word,
+        the given options, if the threshold is not higher
+        """
+        threshold = self.get_threshold(search_word)
+        if threshold is None or threshold <= options.WORD_CONFIDENCE:
+            return options
+        word_options = copy.copy(options)
+        word_options.WORD_CONFIDENCE = float(threshold)
+        return word_options
+
+
+    def accepts(self, search_word, confidence):
+        """
+        Returns True, if a hit with this confidence would enter the ranking of the search word
+        """
+        threshold = self.get_threshold(search_word)
+        return threshold is None or confidence > threshold
+
+
+    def add(self, search_word, confidence, result):
+        """
+        Adds the mapped result of a hit, the lowest hit is dropped, if the search word has more than top_k hits
+        """
+        heap = self.heaps.setdefault(search_word, [])
+        entry = (confidence, -self.hit_count, result)
+        self.hit_count += 1
+        if len(heap) < self.top_k:
+            heapq.heappush(heap, entry)
+        elif confidence > heap[0][0]:
+            heapq.heapreplace(heap, entry)
+
+
+    def __len__(self):
+        """
+        Returns the number of ranked hits of all search words
+        """
+        return sum(len(heap) for heap in self.heaps.values())
+
+
+    def get_ranked_results(self):
+        """
+        Returns the results of all search words, per search word by descending confidence with their Rank
+        """
+        results = []
+        for heap in self.heaps.values():
+            for rank, (_, _, result) in enumerate(sorted(heap, key=lambda entry: entry[:2], reverse=True), 1):
+                ranked_result = dict(result)
+                ranked_result["Rank"] = rank
+                results.append(ranked_result)
+        return results
@@ -0,0 +1,53 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module contains the pytest fixtures of the tests.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import shutil
+import pytest
+
+from tests.synthetic_document import write_document
+
+
+@pytest.fixture(scope="session")
+def document_path(tmp_path_factory):
+    """
+    The synthetic document shared by all tests, which do not write a ConfMat store
+    """
+    path = tmp_path_factory.mktemp("document")
+    write_document(str(path))
+    return str(path)
+
+
+@pytest.fixture
+def document_copy(document_path, tmp_path):
+    """
+    A copy of the synthetic document for the tests, which write ConfMat stores next to the ark
+    """
+    path = tmp_path / "document"
+    shutil.copytree(document_path, path)
+    return str(path)
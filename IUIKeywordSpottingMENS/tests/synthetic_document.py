@@ -0,0 +1,132 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module writes a small synthetic PyLaia document for the tests,
+    a ConfMats.ark with a symbols.txt and the page-xml files of its pages.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import os
+import string
+import numpy as np
+import kaldiio
+
+from iui.core.KWSOptions import KWSOptions
+from iui.utils.KeywordSpottingUtils import KeywordSpottingUtils
+from iui.utils.KWSStats import KWSStats
+
+
+SYMBOLS = ['<ctc>', '<space>'] + list(string.ascii_lowercase) + list(string.ascii_uppercase)
+#the text of every line of the pages, the search words of the tests are spelled right and slightly wrong
+PAGES = {
+    "1001": ["Johan Maier und", "Meier Johann", "und Johan Kirche"],
+    "1002": ["Maier und Maier", "Jonas Anna", "Kirche und Johanna"],
+}
+#the second best character of a frame, so the ConfMats hold near misses like Meier for Maier
+CONFUSIONS = {'e': 'a', 'a': 'o', 'n': 'u', 'i': 'l', 'M': 'N'}
+FRAMES_PER_CHARACTER = 2
+
+
+def create_conf_mat(text, rng):
+    """
+    Returns the log probabilities of a line, every character is read in FRAMES_PER_CHARACTER frames
+    with a blank frame behind, words are separated by space frames. Like in PyLaia lines the
+    text ends with a space, the part behind the last space is not spotted.
+    """
+    symbol_ids = {symbol: index for index, symbol in enumerate(SYMBOLS)}
+    frames = [symbol_ids['<ctc>']]
+    for char in text + ' ':
+        char_id = symbol_ids['<space>'] if char == ' ' else symbol_ids[char]
+        frames.extend([char_id] * FRAMES_PER_CHARACTER)
+        frames.append(symbol_ids['<ctc>'])
+
+    probs = rng.uniform(0.0, 1.0, (len(frames), len(SYMBOLS))) * 1e-4
+    for frame, symbol_id in enumerate(frames):
+        best = rng.uniform(0.8, 0.99)
+        probs[frame, symbol_id] = best
+        confused = CONFUSIONS.get(SYMBOLS[symbol_id])
+        if confused is not None:
+            probs[frame, symbol_ids[confused]] = (1.0 - best) * 0.9
+    probs /= probs.sum(axis=1, keepdims=True)
+    return np.log(probs).astype(np.float32)
+
+
+def write_page_xml(path, page_id, line_count):
+    """
+    Writes a page-xml with the Transkribus metadata and the text lines of one page
+    """
+    lines = ''.join(f'<TextLine id="line_{line}"><Coords points="1,2 30,2 30,40 1,40"/></TextLine>' for line in range(line_count))
+    with open(path, 'w', encoding='utf-8') as xml_file:
+        xml_file.write('<PcGts xmlns="http://schema.primaresearch.org/PAGE/gts/pagecontent/2013-07-15">'
+                       f'<Metadata><TranskribusMetadata pageId="{page_id}" pageNr="{page_id[-1]}" imgUrl="http://localhost/{page_id}" docId="1"/></Metadata>'
+                       f'<Page><TextRegion>{lines}</TextRegion></Page></PcGts>')
+
+
+def write_document(path, seed = 0):
+    """
+    Writes the synthetic document into the given folder
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(path, "Images"), exist_ok=True)
+    with open(os.path.join(path, "symbols.txt"), 'w', encoding='utf-8') as symbols_txt:
+        for index, symbol in enumerate(SYMBOLS):
+            symbols_txt.write(f"{symbol}\t{index}\n")
+    conf_mats = {}
+    for page_id, lines in PAGES.items():
+        write_page_xml(os.path.join(path, "Images", f"{page_id}.xml"), page_id, len(lines))
+        for line, text in enumerate(lines):
+            conf_mats[f"{page_id}.line_{line}"] = create_conf_mat(text, rng)
+    kaldiio.save_ark(os.path.join(path, "ConfMats.ark"), conf_mats)
+
+
+def create_options(search_words, **options):
+    """
+    Returns the options of a test run, by default without ConfMat store
+    """
+    kwsOptions = KWSOptions()
+    kwsOptions.search_words = search_words
+    kwsOptions.WORD_CONFIDENCE = 0.85
+    kwsOptions.USE_CONFMAT_DUMP = False
+    kwsOptions.CREATE_CONFMAT_DUMP = False
+    for name, value in options.items():
+        setattr(kwsOptions, name, value)
+    return kwsOptions
+
+
+def spot(path, search_words, **options):
+    """
+    Spots the comma separated search words in the document with the given options and returns the results,
+    the word counts of the results are counted from this run on
+    """
+    kwsOptions = create_options(search_words, **options)
+    utils = KeywordSpottingUtils()
+    return utils.spot(utils.read_page(path, kwsOptions), search_words, kwsOptions, KWSStats())
+
+
+def get_hits(results):
+    """
+    Returns the confidence of every hit by search word, page, line and word
+    """
+    return {(result["SearchWord"], result["page_id"], result["line_id"], result["word_id"]): result["SearchWordConf"] for result in results}
@@ -0,0 +1,81 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module tests the ConfMat formats and the ConfMat store against
+    the dense ConfMats.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import pytest
+
+from tests.synthetic_document import spot, get_hits
+
+
+SEARCH_WORDS = "Johan,Maier,und,Kirche"
+
+
+@pytest.fixture(scope="module")
+def dense_hits(document_path):
+    return get_hits(spot(document_path, SEARCH_WORDS))
+
+
+@pytest.mark.parametrize("options", [
+    {"LAZY_NORMALIZATION": True},
+    #the floor stays below the character threshold, so no scored cell is dropped
+    {"SPARSE_FLOOR": 0.3},
+    {"SPARSE_TOP_K": 3},
+    {"QUANTIZATION": "uint16"},
+    {"FRAME_COMPRESSION": True},
+    {"FRAME_COMPRESSION": True, "SEARCH_ENGINE": "dp"},
+], ids=lambda options: ",".join(f"{name}={value}" for name, value in options.items()))
+def test_format_matches_dense(document_path, dense_hits, options):
+    hits = get_hits(spot(document_path, SEARCH_WORDS, **options))
+    assert hits == pytest.approx(dense_hits, abs=1e-5)
+
+
+def test_uint8_quantization_matches_dense_within_its_step(document_path, dense_hits):
+    hits = get_hits(spot(document_path, SEARCH_WORDS, QUANTIZATION="uint8"))
+    assert hits == pytest.approx(dense_hits, abs=1 / 255)
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"SPARSE_FLOOR": 0.3},
+    {"QUANTIZATION": "uint8"},
+    {"FRAME_COMPRESSION": True},
+], ids=lambda options: ",".join(f"{name}={value}" for name, value in options.items()) or "dense")
+def test_store_returns_the_spotted_data(document_copy, options):
+    #the first run writes the ConfMat store, the second one spots the store
+    first_results = spot(document_copy, SEARCH_WORDS, USE_CONFMAT_DUMP=True, CREATE_CONFMAT_DUMP=True, **options)
+    second_results = spot(document_copy, SEARCH_WORDS, USE_CONFMAT_DUMP=True, CREATE_CONFMAT_DUMP=True, **options)
+    assert second_results == first_results
+    assert get_hits(second_results) == get_hits(spot(document_copy, SEARCH_WORDS, **options))
+
+
+def test_full_alphabet_split_matches_unreduced_columns(document_path):
+    search_words = SEARCH_WORDS + ",Anna"
+    hits = get_hits(spot(document_path, search_words, SPLIT_ON_FULL_ALPHABET=True))
+    assert hits == pytest.approx(get_hits(spot(document_path, search_words, CLEAN_NONSEARCHWORD_CHARS=False)))
+    assert ("Anna", "1002", "line_1", "3") in hits
@@ -0,0 +1,126 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module tests writing, reading and replacing ConfMat stores.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import os
+import json
+import numpy as np
+import pytest
+
+from iui.utils.ConfMatStore import ConfMatStore, ConfMatStoreWriter, STORE_VERSION, DATA_SUFFIX, INDEX_SUFFIX
+from iui.utils.SparseConfMat import SparseConfMat
+
+
+def create_matrices(seed = 0):
+    rng = np.random.default_rng(seed)
+    return {f"1001.line_{line}": rng.uniform(0.0, 1.0, (rows, 6)).astype(np.float32) for line, rows in enumerate([5, 0, 9])}
+
+
+def write_store(path_prefix, matrices, sparse = False):
+    with ConfMatStoreWriter(path_prefix, sparse=sparse) as writer:
+        for key, matrix in matrices.items():
+            writer.add(key, SparseConfMat.from_dense(matrix, floor=0.5) if sparse else matrix,
+                       frame_map=np.stack([np.arange(len(matrix))] * 2, axis=1), best_path=np.argmax(matrix, axis=1) if len(matrix) else np.zeros(0, dtype=np.intp),
+                       signature=matrix.max(axis=0) if len(matrix) else np.zeros(matrix.shape[1]))
+
+
+def test_dense_store_round_trip(tmp_path):
+    path_prefix = str(tmp_path / "ConfMats_test")
+    matrices = create_matrices()
+    write_store(path_prefix, matrices)
+    store = ConfMatStore(path_prefix)
+    assert list(store) == list(matrices)
+    for key, matrix in matrices.items():
+        np.testing.assert_array_equal(store[key], matrix)
+        np.testing.assert_array_equal(store.get_frame_map(key)[:, 0], np.arange(len(matrix)))
+        if len(matrix):
+            np.testing.assert_array_equal(store.get_best_path(key), np.argmax(matrix, axis=1))
+            np.testing.assert_array_equal(store.get_signature(key), matrix.max(axis=0))
+
+
+def test_sparse_store_round_trip(tmp_path):
+    path_prefix = str(tmp_path / "ConfMats_test")
+    matrices = create_matrices()
+    write_store(path_prefix, matrices, sparse=True)
+    store = ConfMatStore(path_prefix)
+    for key, matrix in matrices.items():
+        np.testing.assert_array_equal(store[key].toarray(), SparseConfMat.from_dense(matrix, floor=0.5).toarray())
+
+
+def test_store_rejects_the_wrong_kind_of_matrix(tmp_path):
+    with ConfMatStoreWriter(str(tmp_path / "ConfMats_test"), sparse=True) as writer:
+        with pytest.raises(ValueError):
+            writer.add("1001.line_0", np.zeros((2, 3), dtype=np.float32))
+
+
+def test_store_of_another_version_is_ignored(tmp_path):
+    path_prefix = str(tmp_path / "ConfMats_test")
+    write_store(path_prefix, create_matrices())
+    with open(path_prefix + INDEX_SUFFIX, 'r', encoding='utf-8') as index_file:
+        index = json.load(index_file)
+    index["version"] = STORE_VERSION - 1
+    with open(path_prefix + INDEX_SUFFIX, 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file)
+    with pytest.raises(ValueError):
+        ConfMatStore(path_prefix)
+    assert ConfMatStore.load(path_prefix) is None
+
+
+def test_incomplete_store_is_ignored(tmp_path):
+    path_prefix = str(tmp_path / "ConfMats_test")
+    write_store(path_prefix, create_matrices())
+    with open(path_prefix + DATA_SUFFIX, 'ab') as data_file:
+        data_file.write(b"\0")
+    assert ConfMatStore.load(path_prefix) is None
+
+
+def test_replacing_a_store_keeps_open_readers_intact(tmp_path):
+    path_prefix = str(tmp_path / "ConfMats_test")
+    old_matrices, new_matrices = create_matrices(0), create_matrices(1)
+    write_store(path_prefix, old_matrices)
+    old_store = ConfMatStore(path_prefix)
+    #the new files are moved over the old ones, the memmap of the open store still maps the old data
+    write_store(path_prefix, new_matrices)
+    new_store = ConfMatStore(path_prefix)
+    for key in old_matrices:
+        np.testing.assert_array_equal(old_store[key], old_matrices[key])
+        np.testing.assert_array_equal(new_store[key], new_matrices[key])
+    assert sorted(os.listdir(tmp_path)) == ["ConfMats_test" + DATA_SUFFIX, "ConfMats_test" + INDEX_SUFFIX]
+
+
+def test_aborted_writer_leaves_the_store_untouched(tmp_path):
+    path_prefix = str(tmp_path / "ConfMats_test")
+    matrices = create_matrices()
+    write_store(path_prefix, matrices)
+    with pytest.raises(RuntimeError):
+        with ConfMatStoreWriter(path_prefix) as writer:
+            writer.add("1001.line_0", np.zeros((3, 6), dtype=np.float32))
+            raise RuntimeError("crashed run")
+    store = ConfMatStore(path_prefix)
+    np.testing.assert_array_equal(store["1001.line_0"], matrices["1001.line_0"])
+    assert sorted(os.listdir(tmp_path)) == ["ConfMats_test" + DATA_SUFFIX, "ConfMats_test" + INDEX_SUFFIX]
@@ -0,0 +1,75 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module tests the parsing of options and search patterns.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import pytest
+
+from iui.core.KWSOptions import parse_byte_size
+from iui.utils.KeywordSpottingMatrixUtils import compile_search_pattern, is_search_pattern
+
+
+SYMBOLS = {0: '<ctc>', 1: ' ', 2: 'a', 3: 'b', 4: 'c'}
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1024", 1024),
+    (4096, 4096),
+    ("500M", 500 * 1024**2),
+    ("20g", 20 * 1024**3),
+    ("1.5K", 1536),
+    ("2KB", 2048),
+    (" 1T ", 1024**4),
+])
+def test_parse_byte_size(value, expected):
+    assert parse_byte_size(value) == expected
+
+
+def test_parse_byte_size_rejects_other_units():
+    with pytest.raises(ValueError):
+        parse_byte_size("12X")
+
+
+@pytest.mark.parametrize("search_word, expected", [
+    ("ab", [([2], 0, 0), ([3], 0, 0)]),
+    ("a?c", [([2], 0, 0), ([2, 3, 4], 0, 0), ([4], 0, 0)]),
+    ("a*c", [([2], 0, 0), ([4], 3, 0)]),
+    ("[bc]a", [([3, 4], 0, 0), ([2], 0, 0)]),
+    #a '*' at the end allows characters behind the last slot
+    ("ab*", [([2], 0, 0), ([3], 0, 3)]),
+    #characters, which are not in the symbols, are skipped
+    ("axb", [([2], 0, 0), ([3], 0, 0)]),
+])
+def test_compile_search_pattern(search_word, expected):
+    assert compile_search_pattern(SYMBOLS, search_word, 3) == expected
+
+
+def test_is_search_pattern():
+    assert is_search_pattern("a?c")
+    assert is_search_pattern("ab*")
+    assert is_search_pattern("[bc]a")
+    assert not is_search_pattern("abc")
@@ -0,0 +1,85 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module tests the search engines and the ranking against the
+    enumeration of all combinations.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import pytest
+
+from iui.utils.KeywordSpottingUtils import KeywordSpottingUtils
+from iui.utils.TopKRanking import TopKRanking
+from tests.synthetic_document import spot, get_hits, create_options
+
+
+SEARCH_WORDS = "Johan,Maier,und,Kirche"
+
+
+@pytest.fixture(scope="module")
+def enumeration_hits(document_path):
+    return get_hits(spot(document_path, SEARCH_WORDS))
+
+
+def test_enumeration_finds_the_written_words(enumeration_hits):
+    assert ("Maier", "1001", "line_0", "3") in enumeration_hits
+    assert ("und", "1002", "line_0", "3") in enumeration_hits
+    assert ("Kirche", "1002", "line_2", "1") in enumeration_hits
+    #the near miss Meier is read with the second best character
+    assert ("Maier", "1001", "line_1", "1") in enumeration_hits
+    assert all(confidence >= 0.85 for confidence in enumeration_hits.values())
+
+
+@pytest.mark.parametrize("search_engine", ["dp", "trie"])
+def test_best_combination_engines_match_enumeration(document_path, enumeration_hits, search_engine):
+    hits = get_hits(spot(document_path, SEARCH_WORDS, SEARCH_ENGINE=search_engine))
+    assert hits == pytest.approx(enumeration_hits)
+
+
+def test_kbest_best_alignment_matches_enumeration(document_path, enumeration_hits):
+    results = spot(document_path, SEARCH_WORDS, SEARCH_ENGINE="kbest", LIMIT_RESULTS=5)
+    #the alternative alignments of a segment are reported with the confidence of each
+    best_hits = {}
+    for result in results:
+        for key, confidence in get_hits([result]).items():
+            best_hits[key] = max(confidence, best_hits.get(key, 0.0))
+    assert best_hits == pytest.approx(enumeration_hits)
+
+
+def test_kbest_takes_one_ranking_place_per_occurrence(document_path):
+    enumeration_results = spot(document_path, SEARCH_WORDS, TOP_K=2)
+    kbest_results = spot(document_path, SEARCH_WORDS, TOP_K=2, SEARCH_ENGINE="kbest", LIMIT_RESULTS=5)
+    assert get_hits(kbest_results) == pytest.approx(get_hits(enumeration_results))
+    assert len(kbest_results) == len(enumeration_results) == 2 * len(SEARCH_WORDS.split(','))
+
+
+def test_ranking_of_a_run_is_shared_by_its_documents(document_path):
+    kwsOptions = create_options(SEARCH_WORDS, TOP_K=2, OUTPUT_CSV=False)
+    utils = KeywordSpottingUtils()
+    ranking = TopKRanking(kwsOptions.TOP_K)
+    for _ in range(2):
+        utils.spot_to_csv(utils.read_page(document_path, kwsOptions), SEARCH_WORDS, kwsOptions, ranking=ranking)
+    ranks = sorted((result["SearchWord"], result["Rank"]) for result in ranking.get_ranked_results())
+    assert ranks == sorted((search_word, rank) for search_word in SEARCH_WORDS.split(',') for rank in (1, 2))
@@ -0,0 +1,70 @@
+"""
+    This is the new Keyword Spotting Tool, which spot's search terms
+    in the PyLaia ConfMats.ark.
+
+    This Module tests the streaming and the parallel decoding against
+    the eager reading of the ConfMats.ark.
+
+    Copyright (C) 2023  Raphael Unterweger
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+'''
+Created on 18.10.2026
+
+@author: run
+'''
+
+import os
+import numpy as np
+import pytest
+
+from iui.utils.ArkIndex import ArkIndex
+from iui.utils.KeywordSpottingUtils import KeywordSpottingUtils
+from tests.synthetic_document import spot, create_options
+
+
+SEARCH_WORDS = "Johan,Maier,und,Kirche"
+
+
+@pytest.fixture(scope="module")
+def eager_results(document_path):
+    return spot(document_path, SEARCH_WORDS)
+
+
+@pytest.mark.parametrize("options", [
+    {"STREAMING_MODE": True},
+    {"DECODE_WORKERS": 2},
+    {"STREAMING_MODE": True, "DECODE_WORKERS": 2},
+], ids=lambda options: ",".join(f"{name}={value}" for name, value in options.items()))
+def test_decoding_matches_eager(document_path, eager_results, options):
+    assert spot(document_path, SEARCH_WORDS, **options) == eager_results
+
+
+def test_spot_to_csv_counts_the_streamed_results(document_path, eager_results):
+    kwsOptions = create_options(SEARCH_WORDS, STREAMING_MODE=True, OUTPUT_CSV=False)
+    utils = KeywordSpottingUtils()
+    assert utils.spot_to_csv(utils.read_page(document_path, kwsOptions), SEARCH_WORDS, kwsOptions) == len(eager_results)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 64])
+def test_parallel_read_matches_read(document_path, chunk_size):
+    ark_index = ArkIndex.build(os.path.join(document_path, "ConfMats.ark"))
+    expected = list(ark_index.read())
+    result = list(ark_index.read_parallel(workers=2, chunk_size=chunk_size))
+    assert [key for key, _ in result] == [key for key, _ in expected]
+    for (_, matrix), (_, expected_matrix) in zip(result, expected):
+        np.testing.assert_array_equal(matrix, expected_matrix)